@@ -1,13 +1,31 @@
 import json
+import base64
+import hashlib
+import hmac
 import os
+import threading
+import time
 import re
 import random
 import smtplib
 from email.mime.text import MIMEText
 from datetime import datetime, timedelta
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 import bcrypt
 
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_MAX_LIFETIME = int(os.environ.get('DB_POOL_MAX_LIFETIME', '600'))
+DB_POOL_CHECK_IDLE = int(os.environ.get('DB_POOL_CHECK_IDLE', '30'))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '10'))
+
+ACCESS_TOKEN_SECRET = os.environ.get('ACCESS_TOKEN_SECRET', '')
+ACCESS_TOKEN_TTL = int(os.environ.get('ACCESS_TOKEN_TTL', '900'))
+REFRESH_TOKEN_DAYS = 30
+STATS_SHARDS = 16
+
 def handler(event: dict, context) -> dict:
     """API для регистрации и авторизации пользователей с email-верификацией"""
     method = event.get('httpMethod', 'GET')
@@ -18,7 +36,7 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type'
+                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
             },
             'body': '',
             'isBase64Encoded': False
@@ -26,13 +44,29 @@ def handler(event: dict, context) -> dict:
     
     path = event.get('queryStringParameters', {}).get('action', '')
     
-    if method == 'POST':
-        if path == 'send-code':
-            return send_verification_code(event)
-        elif path == 'register':
-            return register_user(event)
-        elif path == 'login':
-            return login_user(event)
+    if method == 'GET' and path == 'health':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'status': 'ok', 'pool': get_pool_stats()}),
+            'isBase64Encoded': False
+        }
+    
+    if method == 'POST' and path in ('send-code', 'register', 'login', 'refresh', 'logout'):
+        conn = get_db_connection()
+        try:
+            if path == 'send-code':
+                return send_verification_code(conn, event)
+            elif path == 'register':
+                return register_user(conn, event)
+            elif path == 'login':
+                return login_user(conn, event)
+            elif path == 'refresh':
+                return refresh_access_token(conn, event)
+            elif path == 'logout':
+                return logout_user(conn, event)
+        finally:
+            release_db_connection(conn)
     
     return {
         'statusCode': 400,
@@ -41,7 +75,7 @@ def handler(event: dict, context) -> dict:
         'isBase64Encoded': False
     }
 
-def send_verification_code(event: dict) -> dict:
+def send_verification_code(conn, event: dict) -> dict:
     body = json.loads(event.get('body', '{}'))
     email = body.get('email', '').strip().lower()
     
@@ -53,13 +87,11 @@ def send_verification_code(event: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
     cur = conn.cursor()
     
     cur.execute("SELECT id FROM users WHERE email = %s", (email,))
     if cur.fetchone():
         cur.close()
-        conn.close()
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -76,7 +108,6 @@ def send_verification_code(event: dict) -> dict:
     )
     conn.commit()
     cur.close()
-    conn.close()
     
     send_email(email, code)
     
@@ -87,7 +118,7 @@ def send_verification_code(event: dict) -> dict:
         'isBase64Encoded': False
     }
 
-def register_user(event: dict) -> dict:
+def register_user(conn, event: dict) -> dict:
     body = json.loads(event.get('body', '{}'))
     email = body.get('email', '').strip().lower()
     code = body.get('code', '').strip()
@@ -119,7 +150,6 @@ def register_user(event: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
     cur = conn.cursor()
     
     cur.execute(
@@ -130,7 +160,6 @@ def register_user(event: dict) -> dict:
     
     if not row or row[2]:
         cur.close()
-        conn.close()
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -140,7 +169,6 @@ def register_user(event: dict) -> dict:
     
     if row[0] != code:
         cur.close()
-        conn.close()
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -150,7 +178,6 @@ def register_user(event: dict) -> dict:
     
     if datetime.now() > row[1]:
         cur.close()
-        conn.close()
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -161,7 +188,6 @@ def register_user(event: dict) -> dict:
     cur.execute("SELECT id FROM users WHERE username = %s", (username,))
     if cur.fetchone():
         cur.close()
-        conn.close()
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -172,36 +198,34 @@ def register_user(event: dict) -> dict:
     password_hash = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
     
     cur.execute(
-        "INSERT INTO users (username, email, password_hash, display_name) VALUES (%s, %s, %s, %s) RETURNING id",
+        "INSERT INTO users (username, email, password_hash, display_name) VALUES (%s, %s, %s, %s) RETURNING id, role, token_version",
         (username, email, password_hash, display_name)
     )
-    user_id = cur.fetchone()[0]
+    user_id, role, token_version = cur.fetchone()
     
     cur.execute(
         "UPDATE verification_codes SET used = TRUE WHERE email = %s AND code = %s",
         (email, code)
     )
-    
-    token = generate_token()
-    expires_at = datetime.now() + timedelta(days=30)
-    
     cur.execute(
-        "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, %s)",
-        (user_id, token, expires_at)
+        """INSERT INTO daily_stats (day, shard, registrations) VALUES (CURRENT_DATE, MOD(%s, %s), 1)
+        ON CONFLICT (day, shard) DO UPDATE SET registrations = daily_stats.registrations + 1""",
+        (user_id, STATS_SHARDS)
     )
     
+    tokens = create_session(cur, user_id, role, token_version)
+    
     conn.commit()
     cur.close()
-    conn.close()
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'token': token, 'user_id': user_id}),
+        'body': json.dumps(tokens),
         'isBase64Encoded': False
     }
 
-def login_user(event: dict) -> dict:
+def login_user(conn, event: dict) -> dict:
     body = json.loads(event.get('body', '{}'))
     username = body.get('username', '').strip().lower()
     password = body.get('password', '').strip()
@@ -214,18 +238,16 @@ def login_user(event: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
     cur = conn.cursor()
     
     cur.execute(
-        "SELECT id, password_hash, is_banned FROM users WHERE username = %s",
+        "SELECT id, password_hash, is_banned, role, token_version FROM users WHERE username = %s",
         (username,)
     )
     row = cur.fetchone()
     
     if not row:
         cur.close()
-        conn.close()
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -233,11 +255,10 @@ def login_user(event: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    user_id, password_hash, is_banned = row
+    user_id, password_hash, is_banned, role, token_version = row
     
     if is_banned:
         cur.close()
-        conn.close()
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -247,7 +268,6 @@ def login_user(event: dict) -> dict:
     
     if not bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8')):
         cur.close()
-        conn.close()
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -255,22 +275,96 @@ def login_user(event: dict) -> dict:
             'isBase64Encoded': False
         }
     
-    token = generate_token()
-    expires_at = datetime.now() + timedelta(days=30)
+    tokens = create_session(cur, user_id, role, token_version)
+    
+    conn.commit()
+    cur.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(tokens),
+        'isBase64Encoded': False
+    }
+
+def refresh_access_token(conn, event: dict) -> dict:
+    body = json.loads(event.get('body', '{}'))
+    refresh_token = body.get('refresh_token', '')
+    
+    cur = conn.cursor()
     
     cur.execute(
-        "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, %s)",
-        (user_id, token, expires_at)
+        """SELECT s.id, s.user_id, s.expires_at, u.role, u.is_banned, u.token_version
+        FROM sessions s
+        INNER JOIN users u ON u.id = s.user_id
+        WHERE s.token = %s""",
+        (refresh_token,)
+    )
+    row = cur.fetchone()
+    
+    if not row or datetime.now() > row[2]:
+        cur.close()
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Сессия истекла'}),
+            'isBase64Encoded': False
+        }
+    
+    session_id, user_id, expires_at, role, is_banned, token_version = row
+    
+    if is_banned:
+        cur.close()
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Аккаунт заблокирован'}),
+            'isBase64Encoded': False
+        }
+    
+    token = issue_access_token(user_id, role, session_id, token_version)
+    cur.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'token': token, 'user_id': user_id, 'expires_in': ACCESS_TOKEN_TTL}),
+        'isBase64Encoded': False
+    }
+
+def logout_user(conn, event: dict) -> dict:
+    """Завершает сессию по refresh-токену из тела или по sid access-токена из X-Authorization"""
+    body = json.loads(event.get('body') or '{}')
+    refresh_token = body.get('refresh_token')
+    claims = None if refresh_token else verify_access_token(
+        event.get('headers', {}).get('X-Authorization', '').replace('Bearer ', '')
     )
     
+    if not refresh_token and not claims:
+        return {
+            'statusCode': 401,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Unauthorized'}),
+            'isBase64Encoded': False
+        }
+    
+    cur = conn.cursor()
+    
+    if refresh_token:
+        cur.execute("DELETE FROM sessions WHERE token = %s RETURNING id", (refresh_token,))
+    else:
+        cur.execute("DELETE FROM sessions WHERE id = %s RETURNING id", (claims['sid'],))
+    row = cur.fetchone()
+    if row:
+        cur.execute("INSERT INTO auth_invalidations (session_id) VALUES (%s)", (row[0],))
+    
     conn.commit()
     cur.close()
-    conn.close()
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'token': token, 'user_id': user_id}),
+        'body': json.dumps({'message': 'Сессия завершена'}),
         'isBase64Encoded': False
     }
 
@@ -298,13 +392,159 @@ def send_email(email: str, code: str):
         print(f"Email send error: {e}")
         print(f"DEBUG: Code for {email}: {code}")
 
+_pool_lock = threading.Condition()
+_pool_idle = []
+_pool_born = {}
+_pool_stats = {'created': 0, 'reused': 0, 'discarded': 0, 'health_check_failures': 0, 'waits': 0}
+
 def get_db_connection():
+    """Выдаёт соединение из пула, живущего между тёплыми вызовами функции"""
+    with _pool_lock:
+        while True:
+            while _pool_idle:
+                conn, last_used = _pool_idle.pop()
+                if is_connection_alive(conn, last_used):
+                    _pool_stats['reused'] += 1
+                    return conn
+                discard_db_connection(conn)
+            
+            if len(_pool_born) < DB_POOL_MAX_SIZE:
+                break
+            
+            _pool_stats['waits'] += 1
+            if not _pool_lock.wait(timeout=DB_POOL_TIMEOUT):
+                raise psycopg2.pool.PoolError('connection pool exhausted')
+        
+        conn = open_db_connection()
+        while len(_pool_born) < DB_POOL_MIN_SIZE:
+            _pool_idle.append((open_db_connection(), time.monotonic()))
+        return conn
+
+def release_db_connection(conn):
+    with _pool_lock:
+        if conn not in _pool_born:
+            return
+        
+        try:
+            if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            pass
+        
+        expired = time.monotonic() - _pool_born[conn] > DB_POOL_MAX_LIFETIME
+        if conn.closed or expired or len(_pool_idle) >= DB_POOL_MAX_SIZE:
+            discard_db_connection(conn)
+        else:
+            _pool_idle.append((conn, time.monotonic()))
+        _pool_lock.notify()
+
+def open_db_connection():
     dsn = os.environ.get('DATABASE_URL')
     schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
     
     conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
+    _pool_born[conn] = time.monotonic()
+    _pool_stats['created'] += 1
     return conn
 
+def discard_db_connection(conn):
+    _pool_born.pop(conn, None)
+    _pool_stats['discarded'] += 1
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def is_connection_alive(conn, last_used: float) -> bool:
+    if conn.closed:
+        return False
+    
+    if time.monotonic() - _pool_born[conn] > DB_POOL_MAX_LIFETIME:
+        return False
+    
+    if time.monotonic() - last_used < DB_POOL_CHECK_IDLE:
+        return True
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        _pool_stats['health_check_failures'] += 1
+        return False
+
+def get_pool_stats() -> dict:
+    with _pool_lock:
+        return {
+            'size': len(_pool_born),
+            'idle': len(_pool_idle),
+            'in_use': len(_pool_born) - len(_pool_idle),
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            **_pool_stats
+        }
+
+def create_session(cur, user_id: int, role: str, token_version: int) -> dict:
+    """Долгоживущий refresh-токен хранится в sessions, короткий access-токен подписан и в БД не попадает"""
+    refresh_token = generate_token()
+    cur.execute(
+        "INSERT INTO sessions (user_id, token, expires_at) VALUES (%s, %s, %s) RETURNING id",
+        (user_id, refresh_token, datetime.now() + timedelta(days=REFRESH_TOKEN_DAYS))
+    )
+    session_id = cur.fetchone()[0]
+    
+    return {
+        'token': issue_access_token(user_id, role, session_id, token_version),
+        'refresh_token': refresh_token,
+        'user_id': user_id,
+        'expires_in': ACCESS_TOKEN_TTL
+    }
+
+def issue_access_token(user_id: int, role: str, session_id: int, token_version: int) -> str:
+    """ver — users.token_version из той же выборки, что и role: токен отзывают записи с большей версией.
+    
+    Версия растёт под блокировкой строки пользователя, поэтому бан, ещё не закоммиченный в момент
+    выдачи, всё равно получит версию больше ver."""
+    if not ACCESS_TOKEN_SECRET:
+        raise RuntimeError('ACCESS_TOKEN_SECRET не задан')
+    
+    claims = {
+        'uid': user_id,
+        'role': role,
+        'sid': session_id,
+        'ver': token_version,
+        'exp': int(time.time()) + ACCESS_TOKEN_TTL
+    }
+    payload = encode_token_part(json.dumps(claims, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    signature = hmac.new(ACCESS_TOKEN_SECRET.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).digest()
+    return f'{payload}.{encode_token_part(signature)}'
+
+def verify_access_token(token: str) -> dict:
+    if not token or not ACCESS_TOKEN_SECRET or token.count('.') != 1:
+        return None
+    
+    payload, signature = token.split('.')
+    expected = hmac.new(ACCESS_TOKEN_SECRET.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).digest()
+    try:
+        if not hmac.compare_digest(decode_token_part(signature), expected):
+            return None
+        claims = json.loads(decode_token_part(payload))
+    except ValueError:
+        return None
+    
+    if claims['exp'] < time.time():
+        return None
+    
+    return claims
+
+def encode_token_part(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).decode('ascii').rstrip('=')
+
+def decode_token_part(part: str) -> bytes:
+    return base64.urlsafe_b64decode(part + '=' * (-len(part) % 4))
+
 def generate_token() -> str:
     import secrets
     return secrets.token_urlsafe(32)
\ No newline at end of file
@@ -1,7 +1,62 @@
 import json
+import hmac
 import os
+import select
+import csv
+import hashlib
+import io
+import gzip
+import base64
+import threading
+import time
+import boto3
 import psycopg2
-from datetime import datetime
+import psycopg2.extensions
+import psycopg2.pool
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_MAX_LIFETIME = int(os.environ.get('DB_POOL_MAX_LIFETIME', '600'))
+DB_POOL_CHECK_IDLE = int(os.environ.get('DB_POOL_CHECK_IDLE', '30'))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '10'))
+
+ACCESS_TOKEN_SECRET = os.environ.get('ACCESS_TOKEN_SECRET', '')
+ACCESS_TOKEN_TTL = int(os.environ.get('ACCESS_TOKEN_TTL', '900'))
+REVOCATION_CHECK_INTERVAL = float(os.environ.get('REVOCATION_CHECK_INTERVAL', '2'))
+REVOCATION_LATE_COMMIT_WINDOW = 60
+
+INBOX_PREVIEW_LENGTH = 200
+MESSAGES_PAGE_SIZE = 50
+MESSAGES_PAGE_MAX = 200
+SYNC_MESSAGES_LIMIT = 500
+SYNC_DEFER_RETRY = 0.5
+WAIT_TIMEOUT_MAX = 25
+IMPORT_BATCH_SIZE = 5000
+IMPORT_MAX_ERRORS = 1000
+MISSING_PARTITION_PGCODE = '23514'
+UNREAD_COUNT_CAP = 1000
+STATS_SHARDS = 16
+SEARCH_PAGE_SIZE = 20
+SEARCH_PAGE_MAX = 100
+SEARCH_HEADLINE_OPTIONS = 'StartSel=<mark>, StopSel=</mark>, MaxWords=20, MinWords=5, MaxFragments=2'
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+ARCHIVE_BUCKET = os.environ.get('ARCHIVE_BUCKET', 'files')
+ARCHIVE_CACHE_SIZE = 16
+
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+_s3_client = None
+_archive_cache = OrderedDict()
 
 def handler(event: dict, context) -> dict:
     """API для управления чатами, сообщениями и контактами"""
@@ -13,14 +68,31 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
+                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization, If-None-Match'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    user_id = get_user_from_token(event)
-    if not user_id:
+    action = event.get('queryStringParameters', {}).get('action', '')
+    
+    if method == 'GET' and action == 'health':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'status': 'ok', 'pool': get_pool_stats(), 'revocations': get_revocation_stats()}),
+            'isBase64Encoded': False
+        }
+    
+    conn = get_db_connection()
+    try:
+        return compress_response(event, route_request(conn, event, method, action))
+    finally:
+        release_db_connection(conn)
+
+def route_request(conn, event: dict, method: str, action: str) -> dict:
+    principal = get_principal(conn, event)
+    if not principal:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -28,24 +100,34 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    action = event.get('queryStringParameters', {}).get('action', '')
+    user_id = principal['uid']
+    
+    if method == 'POST' and action == 'send':
+        return send_message(conn, event, user_id)
     
     if method == 'GET':
         if action == 'list':
-            return list_chats(user_id)
+            return list_chats(conn, event, user_id)
         elif action == 'messages':
-            chat_id = event.get('queryStringParameters', {}).get('chat_id')
-            return get_messages(user_id, chat_id)
+            return get_messages(conn, event, user_id)
         elif action == 'contacts':
-            return list_contacts(user_id)
+            return list_contacts(conn, event, user_id)
+        elif action == 'sync':
+            return sync_changes(conn, user_id, event.get('queryStringParameters', {}))
+        elif action == 'wait':
+            return wait_for_changes(conn, user_id, event.get('queryStringParameters', {}))
+        elif action == 'search-messages':
+            return search_messages(conn, user_id, event.get('queryStringParameters', {}))
     
     if method == 'POST':
         if action == 'create':
-            return create_chat(event, user_id)
-        elif action == 'send':
-            return send_message(event, user_id)
+            return create_chat(conn, event, user_id)
         elif action == 'add-contact':
-            return add_contact(event, user_id)
+            return add_contact(conn, event, user_id)
+        elif action == 'import':
+            return import_messages(conn, event, principal)
+        elif action == 'mark-read':
+            return mark_chat_read(conn, event, user_id)
     
     return {
         'statusCode': 400,
@@ -54,36 +136,62 @@ def handler(event: dict, context) -> dict:
         'isBase64Encoded': False
     }
 
-def list_chats(user_id: int) -> dict:
-    conn = get_db_connection()
+def list_chats(conn, event: dict, user_id: int) -> dict:
     cur = conn.cursor()
     
     cur.execute(
-        """SELECT DISTINCT c.id, c.created_at, c.updated_at,
-        (SELECT u.id FROM users u 
-         INNER JOIN chat_participants cp2 ON cp2.user_id = u.id 
-         WHERE cp2.chat_id = c.id AND u.id != %s LIMIT 1) as other_user_id,
-        (SELECT u.username FROM users u 
-         INNER JOIN chat_participants cp2 ON cp2.user_id = u.id 
-         WHERE cp2.chat_id = c.id AND u.id != %s LIMIT 1) as other_username,
-        (SELECT u.display_name FROM users u 
-         INNER JOIN chat_participants cp2 ON cp2.user_id = u.id 
-         WHERE cp2.chat_id = c.id AND u.id != %s LIMIT 1) as other_display_name,
-        (SELECT u.avatar_url FROM users u 
-         INNER JOIN chat_participants cp2 ON cp2.user_id = u.id 
-         WHERE cp2.chat_id = c.id AND u.id != %s LIMIT 1) as other_avatar,
-        (SELECT m.content FROM messages m WHERE m.chat_id = c.id ORDER BY m.created_at DESC LIMIT 1) as last_message,
-        (SELECT m.created_at FROM messages m WHERE m.chat_id = c.id ORDER BY m.created_at DESC LIMIT 1) as last_message_time
-        FROM chats c
-        INNER JOIN chat_participants cp ON cp.chat_id = c.id
-        WHERE cp.user_id = %s
+        """SELECT COUNT(*), MAX(GREATEST(c.change_seq, cp.change_seq)), MAX(u.updated_at)
+        FROM chat_participants cp
+        INNER JOIN chats c ON c.id = cp.chat_id
+        LEFT JOIN chat_participants other ON other.chat_id = cp.chat_id AND other.user_id != cp.user_id
+        LEFT JOIN users u ON u.id = other.user_id
+        WHERE cp.user_id = %s""",
+        (user_id,)
+    )
+    etag = make_etag('chats', user_id, *cur.fetchone())
+    if etag_matches(event, etag):
+        cur.close()
+        return not_modified(etag)
+    
+    chats = fetch_chats(cur, user_id)
+    cur.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'Cache-Control': 'no-cache',
+            'ETag': etag
+        },
+        'body': dump_json({'chats': chats}),
+        'isBase64Encoded': False
+    }
+
+def fetch_chats(cur, user_id: int, window: tuple = None) -> list:
+    since_filter = 'AND GREATEST(c.change_xid, cp.change_xid) >= %s AND GREATEST(c.change_xid, cp.change_xid) < %s' if window else ''
+    cur.execute(
+        f"""SELECT c.id, c.created_at, c.updated_at,
+        u.id, u.username, u.display_name, u.avatar_url,
+        c.last_message_preview, c.last_message_at, c.last_message_id, c.last_message_sender_id,
+        cp.unread_count, cp.last_read_message_id, u.avatars
+        FROM chat_participants cp
+        INNER JOIN chats c ON c.id = cp.chat_id
+        LEFT JOIN LATERAL (
+            SELECT cp2.user_id FROM chat_participants cp2
+            WHERE cp2.chat_id = c.id AND cp2.user_id != cp.user_id
+            LIMIT 1
+        ) other ON TRUE
+        LEFT JOIN users u ON u.id = other.user_id
+        WHERE cp.user_id = %s {since_filter}
         ORDER BY c.updated_at DESC""",
-        (user_id, user_id, user_id, user_id, user_id)
+        (user_id, *window) if window else (user_id,)
     )
     
     chats = []
     for row in cur.fetchall():
-        chat_data = {
+        chats.append({
             'id': row[0],
             'created_at': row[1].isoformat() if row[1] else None,
             'updated_at': row[2].isoformat() if row[2] else None,
@@ -91,24 +199,19 @@ def list_chats(user_id: int) -> dict:
                 'id': row[3],
                 'username': row[4],
                 'display_name': row[5],
-                'avatar_url': row[6]
+                'avatar_url': row[6],
+                'avatars': row[13]
             } if row[3] else None,
             'last_message': row[7],
-            'last_message_time': row[8].isoformat() if row[8] else None
-        }
-        chats.append(chat_data)
-    
-    cur.close()
-    conn.close()
-    
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'chats': chats}),
-        'isBase64Encoded': False
-    }
+            'last_message_time': row[8].isoformat() if row[8] else None,
+            'last_message_id': row[9],
+            'last_message_sender_id': row[10],
+            'unread_count': row[11],
+            'last_read_message_id': row[12]
+        })
+    return chats
 
-def create_chat(event: dict, user_id: int) -> dict:
+def create_chat(conn, event: dict, user_id: int) -> dict:
     body = json.loads(event.get('body', '{}'))
     other_user_id = body.get('user_id')
     
@@ -120,6 +223,16 @@ def create_chat(event: dict, user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
+    try:
+        other_user_id = int(other_user_id)
+    except (TypeError, ValueError):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'user_id обязателен'}),
+            'isBase64Encoded': False
+        }
+    
     if other_user_id == user_id:
         return {
             'statusCode': 400,
@@ -128,13 +241,24 @@ def create_chat(event: dict, user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
+    direct_key = f'{min(user_id, other_user_id)}:{max(user_id, other_user_id)}'
     cur = conn.cursor()
     
+    cur.execute("SELECT id FROM chats WHERE direct_key = %s", (direct_key,))
+    existing = cur.fetchone()
+    
+    if existing:
+        cur.close()
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'chat_id': existing[0], 'existed': True}),
+            'isBase64Encoded': False
+        }
+    
     cur.execute("SELECT id FROM users WHERE id = %s", (other_user_id,))
     if not cur.fetchone():
         cur.close()
-        conn.close()
         return {
             'statusCode': 404,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -143,47 +267,45 @@ def create_chat(event: dict, user_id: int) -> dict:
         }
     
     cur.execute(
-        """SELECT c.id FROM chats c
-        INNER JOIN chat_participants cp1 ON cp1.chat_id = c.id AND cp1.user_id = %s
-        INNER JOIN chat_participants cp2 ON cp2.chat_id = c.id AND cp2.user_id = %s
-        LIMIT 1""",
-        (user_id, other_user_id)
+        """WITH created AS (
+            INSERT INTO chats (created_by, direct_key) VALUES (%s, %s)
+            ON CONFLICT (direct_key) DO NOTHING
+            RETURNING id
+        ),
+        joined AS (
+            INSERT INTO chat_participants (chat_id, user_id)
+            SELECT created.id, participant.user_id
+            FROM created, (VALUES (%s), (%s)) AS participant(user_id)
+            RETURNING chat_id
+        )
+        SELECT id, (SELECT COUNT(*) FROM joined) FROM created""",
+        (user_id, direct_key, user_id, other_user_id)
     )
-    existing = cur.fetchone()
+    created = cur.fetchone()
+    conn.commit()
     
-    if existing:
+    if not created:
+        cur.execute("SELECT id FROM chats WHERE direct_key = %s", (direct_key,))
+        chat_id = cur.fetchone()[0]
         cur.close()
-        conn.close()
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'chat_id': existing[0], 'existed': True}),
+            'body': json.dumps({'chat_id': chat_id, 'existed': True}),
             'isBase64Encoded': False
         }
     
-    cur.execute(
-        "INSERT INTO chats (created_by) VALUES (%s) RETURNING id",
-        (user_id,)
-    )
-    chat_id = cur.fetchone()[0]
-    
-    cur.execute(
-        "INSERT INTO chat_participants (chat_id, user_id) VALUES (%s, %s), (%s, %s)",
-        (chat_id, user_id, chat_id, other_user_id)
-    )
-    
-    conn.commit()
     cur.close()
-    conn.close()
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'chat_id': chat_id, 'existed': False}),
+        'body': json.dumps({'chat_id': created[0], 'existed': False}),
         'isBase64Encoded': False
     }
 
-def send_message(event: dict, user_id: int) -> dict:
+def send_message(conn, event: dict, sender_id: int) -> dict:
+    """Проверка бана, участия в чате и запись сообщения одним запросом"""
     body = json.loads(event.get('body', '{}'))
     chat_id = body.get('chat_id')
     content = body.get('content', '').strip()
@@ -196,14 +318,82 @@ def send_message(event: dict, user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
     cur = conn.cursor()
     
-    cur.execute("SELECT is_banned FROM users WHERE id = %s", (user_id,))
-    row = cur.fetchone()
-    if row and row[0]:
+    execute_with_partition(
+        conn, cur,
+        """WITH auth AS (
+            SELECT id AS user_id, is_banned FROM users WHERE id = %(user_id)s
+        ),
+        member AS (
+            SELECT cp.chat_id
+            FROM chat_participants cp
+            INNER JOIN auth ON auth.user_id = cp.user_id
+            WHERE cp.chat_id = %(chat_id)s
+        ),
+        inserted AS (
+            INSERT INTO messages (chat_id, sender_id, content)
+            SELECT member.chat_id, auth.user_id, %(content)s
+            FROM auth, member
+            WHERE auth.is_banned IS NOT TRUE
+            RETURNING id, chat_id, sender_id, content, created_at
+        ),
+        inbox AS (
+            UPDATE chats c SET updated_at = inserted.created_at, change_seq = nextval('change_seq'),
+            last_message_id = inserted.id, last_message_preview = LEFT(inserted.content, %(preview_length)s),
+            last_message_at = inserted.created_at, last_message_sender_id = inserted.sender_id
+            FROM inserted
+            WHERE c.id = inserted.chat_id
+            RETURNING c.id
+        ),
+        unread AS (
+            UPDATE chat_participants cp SET
+            unread_count = CASE WHEN cp.user_id = inserted.sender_id THEN 0 ELSE cp.unread_count + 1 END,
+            last_read_message_id = CASE WHEN cp.user_id = inserted.sender_id THEN inserted.id ELSE cp.last_read_message_id END
+            FROM inserted
+            WHERE cp.chat_id = inserted.chat_id
+            RETURNING cp.id
+        ),
+        notified AS (
+            SELECT pg_notify('chat_user_' || cp.user_id,
+                json_build_object('chat_id', inserted.chat_id, 'message_id', inserted.id)::text)
+            FROM inserted
+            INNER JOIN chat_participants cp ON cp.chat_id = inserted.chat_id
+        ),
+        active AS (
+            INSERT INTO daily_active_users (day, user_id)
+            SELECT inserted.created_at::date, inserted.sender_id FROM inserted
+            ON CONFLICT DO NOTHING
+            RETURNING day
+        ),
+        counted AS (
+            INSERT INTO daily_stats (day, shard, messages_sent, active_users)
+            SELECT inserted.created_at::date, MOD(inserted.sender_id, %(stats_shards)s), 1, (SELECT COUNT(*) FROM active)
+            FROM inserted
+            ON CONFLICT (day, shard) DO UPDATE SET
+            messages_sent = daily_stats.messages_sent + 1,
+            active_users = daily_stats.active_users + EXCLUDED.active_users
+            RETURNING day
+        )
+        SELECT auth.user_id, auth.is_banned, member.chat_id, inserted.id, inserted.created_at,
+        (SELECT COUNT(*) FROM inbox), (SELECT COUNT(*) FROM unread), (SELECT COUNT(*) FROM notified),
+        (SELECT COUNT(*) FROM counted)
+        FROM (SELECT 1) request
+        LEFT JOIN auth ON TRUE
+        LEFT JOIN member ON TRUE
+        LEFT JOIN inserted ON TRUE""",
+        {
+            'user_id': sender_id,
+            'chat_id': chat_id,
+            'content': content,
+            'preview_length': INBOX_PREVIEW_LENGTH,
+            'stats_shards': STATS_SHARDS
+        }
+    )
+    user_id, is_banned, member_chat_id, message_id, created_at = cur.fetchone()[:5]
+    
+    if not user_id or is_banned:
         cur.close()
-        conn.close()
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -211,13 +401,8 @@ def send_message(event: dict, user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
-    cur.execute(
-        "SELECT id FROM chat_participants WHERE chat_id = %s AND user_id = %s",
-        (chat_id, user_id)
-    )
-    if not cur.fetchone():
+    if not member_chat_id:
         cur.close()
-        conn.close()
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -225,20 +410,8 @@ def send_message(event: dict, user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
-    cur.execute(
-        "INSERT INTO messages (chat_id, sender_id, content) VALUES (%s, %s, %s) RETURNING id, created_at",
-        (chat_id, user_id, content)
-    )
-    message_id, created_at = cur.fetchone()
-    
-    cur.execute(
-        "UPDATE chats SET updated_at = %s WHERE id = %s",
-        (datetime.now(), chat_id)
-    )
-    
     conn.commit()
     cur.close()
-    conn.close()
     
     return {
         'statusCode': 200,
@@ -250,7 +423,24 @@ def send_message(event: dict, user_id: int) -> dict:
         'isBase64Encoded': False
     }
 
-def get_messages(user_id: int, chat_id: str) -> dict:
+def execute_with_partition(conn, cur, query: str, params: dict):
+    """Запись в messages; если партиции на текущий месяц нет (таймер обслуживания стоял), создаёт её и повторяет"""
+    try:
+        cur.execute(query, params)
+    except psycopg2.Error as e:
+        if e.pgcode != MISSING_PARTITION_PGCODE:
+            raise
+        conn.rollback()
+        now = datetime.now()
+        cur.execute("SELECT ensure_messages_partitions(%s, %s)", (now, now))
+        conn.commit()
+        cur.execute(query, params)
+
+def mark_chat_read(conn, event: dict, user_id: int) -> dict:
+    body = json.loads(event.get('body', '{}'))
+    chat_id = body.get('chat_id')
+    message_id = body.get('message_id')
+    
     if not chat_id:
         return {
             'statusCode': 400,
@@ -259,16 +449,331 @@ def get_messages(user_id: int, chat_id: str) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
+    cur = conn.cursor()
+    
+    if message_id:
+        cur.execute(
+            """UPDATE chat_participants cp SET last_read_message_id = m.id,
+            change_seq = nextval('change_seq'),
+            unread_count = (
+                SELECT COUNT(*) FROM (
+                    SELECT 1 FROM messages later
+                    WHERE later.chat_id = m.chat_id
+                    AND (later.created_at, later.id) > (m.created_at, m.id)
+                    AND later.sender_id != cp.user_id
+                    LIMIT %s
+                ) unread
+            )
+            FROM messages m
+            WHERE cp.chat_id = %s AND cp.user_id = %s AND m.id = %s AND m.chat_id = cp.chat_id
+            RETURNING cp.unread_count, cp.last_read_message_id""",
+            (UNREAD_COUNT_CAP, chat_id, user_id, message_id)
+        )
+    else:
+        cur.execute(
+            """UPDATE chat_participants cp SET last_read_message_id = c.last_message_id,
+            change_seq = nextval('change_seq'), unread_count = 0
+            FROM chats c
+            WHERE c.id = cp.chat_id AND cp.chat_id = %s AND cp.user_id = %s
+            RETURNING cp.unread_count, cp.last_read_message_id""",
+            (chat_id, user_id)
+        )
+    row = cur.fetchone()
+    
+    if not row:
+        cur.close()
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Доступ к чату запрещён'}),
+            'isBase64Encoded': False
+        }
+    
+    conn.commit()
+    cur.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'unread_count': row[0], 'last_read_message_id': row[1]}),
+        'isBase64Encoded': False
+    }
+
+def import_messages(conn, event: dict, principal: dict) -> dict:
+    """Массовая загрузка сообщений (NDJSON или JSON-массив) через COPY пачками"""
+    if principal['role'] not in ['владелец', 'администратор']:
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Доступ запрещён'}),
+            'isBase64Encoded': False
+        }
+    
+    raw = event.get('body') or ''
+    if event.get('isBase64Encoded'):
+        raw = base64.b64decode(raw).decode('utf-8')
+    
+    cur = conn.cursor()
+    cur.execute("SELECT range_start, range_end FROM message_archives")
+    archived_ranges = cur.fetchall()
+    
+    errors = []
+    batch = []
+    imported = 0
+    sender_counts = {}
+    
+    for index, record in iter_import_records(raw):
+        message, error = validate_import_record(record)
+        if error:
+            errors.append({'row': index, 'error': error})
+            continue
+        
+        batch.append((index, message))
+        if len(batch) >= IMPORT_BATCH_SIZE:
+            imported += copy_import_batch(conn, cur, batch, errors, sender_counts, archived_ranges)
+            batch = []
+    
+    if batch:
+        imported += copy_import_batch(conn, cur, batch, errors, sender_counts, archived_ranges)
+    
+    touched_chats = list({chat_id for chat_id, _ in sender_counts})
+    if touched_chats:
+        cur.execute(
+            """UPDATE chats c SET updated_at = GREATEST(c.updated_at, last.created_at),
+            change_seq = nextval('change_seq'),
+            last_message_id = last.id, last_message_preview = LEFT(last.content, %s),
+            last_message_at = last.created_at, last_message_sender_id = last.sender_id
+            FROM unnest(%s::int[]) touched(chat_id)
+            CROSS JOIN LATERAL (
+                SELECT m.id, m.chat_id, m.sender_id, m.content, m.created_at
+                FROM messages m
+                WHERE m.chat_id = touched.chat_id
+                ORDER BY m.created_at DESC, m.id DESC
+                LIMIT 1
+            ) last
+            WHERE c.id = last.chat_id""",
+            (INBOX_PREVIEW_LENGTH, touched_chats)
+        )
+        cur.execute(
+            """WITH imported AS (
+                SELECT * FROM unnest(%s::int[], %s::int[], %s::int[]) AS t(chat_id, sender_id, total)
+            )
+            UPDATE chat_participants cp SET unread_count = cp.unread_count + (
+                SELECT COALESCE(SUM(i.total), 0) FROM imported i
+                WHERE i.chat_id = cp.chat_id AND i.sender_id != cp.user_id
+            )
+            WHERE cp.chat_id = ANY(%s)""",
+            (
+                [chat_id for chat_id, _ in sender_counts],
+                [sender_id for _, sender_id in sender_counts],
+                list(sender_counts.values()),
+                touched_chats
+            )
+        )
+        cur.execute(
+            """SELECT pg_notify('chat_user_' || user_id, json_build_object('chat_id', chat_id)::text)
+            FROM chat_participants WHERE chat_id = ANY(%s)""",
+            (touched_chats,)
+        )
+        conn.commit()
+    
+    cur.close()
+    
+    errors.sort(key=lambda e: e['row'])
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'imported': imported,
+            'failed': len(errors),
+            'chats': len(touched_chats),
+            'errors': errors[:IMPORT_MAX_ERRORS],
+            'errors_truncated': len(errors) > IMPORT_MAX_ERRORS
+        }),
+        'isBase64Encoded': False
+    }
+
+def iter_import_records(raw: str):
+    if raw.lstrip().startswith('['):
+        try:
+            records = json.loads(raw)
+        except ValueError as e:
+            yield 0, e
+            return
+        for index, record in enumerate(records):
+            yield index, record
+        return
+    
+    for index, line in enumerate(raw.splitlines()):
+        if not line.strip():
+            continue
+        try:
+            yield index, json.loads(line)
+        except ValueError as e:
+            yield index, e
+
+def validate_import_record(record) -> tuple:
+    if isinstance(record, Exception):
+        return None, f'Некорректный JSON: {record}'
+    
+    if not isinstance(record, dict):
+        return None, 'Ожидается объект'
+    
+    chat_id = record.get('chat_id')
+    sender_id = record.get('sender_id')
+    content = record.get('content')
+    
+    if type(chat_id) is not int or type(sender_id) is not int:
+        return None, 'chat_id и sender_id должны быть числами'
+    
+    if not isinstance(content, str) or not content.strip():
+        return None, 'content обязателен'
+    
+    created_at = record.get('created_at')
+    if created_at is None:
+        created_at = datetime.now()
+    else:
+        try:
+            created_at = datetime.fromisoformat(created_at)
+        except (TypeError, ValueError):
+            return None, 'Некорректный created_at'
+        if created_at.tzinfo:
+            created_at = created_at.astimezone(timezone.utc).replace(tzinfo=None)
+    
+    return (chat_id, sender_id, content, created_at), None
+
+def copy_import_batch(conn, cur, batch: list, errors: list, sender_counts: dict, archived_ranges: list) -> int:
+    chat_ids = list({message[0] for _, message in batch})
+    cur.execute(
+        "SELECT chat_id, user_id FROM chat_participants WHERE chat_id = ANY(%s)",
+        (chat_ids,)
+    )
+    members = set(cur.fetchall())
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    copied = []
+    oldest = newest = None
+    for index, (chat_id, sender_id, content, created_at) in batch:
+        if (chat_id, sender_id) not in members:
+            errors.append({'row': index, 'error': 'Отправитель не участник чата'})
+            continue
+        if any(range_start <= created_at < range_end for range_start, range_end in archived_ranges):
+            errors.append({'row': index, 'error': 'Месяц уже выгружен в архив'})
+            continue
+        writer.writerow((chat_id, sender_id, content, created_at.isoformat()))
+        copied.append((index, chat_id, sender_id, created_at.date()))
+        oldest = min(oldest, created_at) if oldest else created_at
+        newest = max(newest, created_at) if newest else created_at
+    
+    if not copied:
+        return 0
+    
+    buffer.seek(0)
+    try:
+        cur.execute("SELECT ensure_messages_partitions(%s, %s)", (oldest, newest))
+        cur.copy_expert(
+            "COPY messages (chat_id, sender_id, content, created_at) FROM STDIN WITH (FORMAT csv)",
+            buffer
+        )
+        count_imported_stats(cur, [row[3] for row in copied], [row[2] for row in copied])
+        conn.commit()
+    except psycopg2.Error as e:
+        conn.rollback()
+        for index, _, _, _ in copied:
+            errors.append({'row': index, 'error': f'Ошибка записи пачки: {e.pgerror or e}'})
+        return 0
+    
+    for _, chat_id, sender_id, _ in copied:
+        sender_counts[(chat_id, sender_id)] = sender_counts.get((chat_id, sender_id), 0) + 1
+    return len(copied)
+
+def count_imported_stats(cur, days: list, sender_ids: list):
+    """Импортированная пачка в daily_stats той же транзакцией, что и COPY.
+    
+    messages_sent прибавляется сразу. Активных за сегодня и вчера учитывает daily_active_users, как send;
+    более старые дни этой таблицей не покрыты, поэтому помечаются в daily_stats_dirty и пересчитываются обслуживанием."""
+    cur.execute(
+        """WITH imported AS (
+            SELECT * FROM unnest(%(days)s::date[], %(sender_ids)s::int[]) AS t(day, sender_id)
+        ),
+        active AS (
+            INSERT INTO daily_active_users (day, user_id)
+            SELECT DISTINCT day, sender_id FROM imported WHERE day >= CURRENT_DATE - 1
+            ON CONFLICT DO NOTHING
+            RETURNING day, user_id
+        ),
+        dirty AS (
+            INSERT INTO daily_stats_dirty (day)
+            SELECT DISTINCT day FROM imported WHERE day < CURRENT_DATE - 1
+            ON CONFLICT (day) DO UPDATE SET marked_at = CURRENT_TIMESTAMP
+            RETURNING day
+        )
+        INSERT INTO daily_stats (day, shard, messages_sent, active_users)
+        SELECT day, shard, SUM(messages_sent), SUM(active_users)
+        FROM (
+            SELECT day, MOD(sender_id, %(stats_shards)s) AS shard, COUNT(*) AS messages_sent, 0 AS active_users
+            FROM imported GROUP BY 1, 2
+            UNION ALL
+            SELECT day, MOD(user_id, %(stats_shards)s), 0, COUNT(*) FROM active GROUP BY 1, 2
+        ) counts
+        GROUP BY day, shard
+        ON CONFLICT (day, shard) DO UPDATE SET
+        messages_sent = daily_stats.messages_sent + EXCLUDED.messages_sent,
+        active_users = daily_stats.active_users + EXCLUDED.active_users""",
+        {'days': days, 'sender_ids': sender_ids, 'stats_shards': STATS_SHARDS}
+    )
+
+def get_messages(conn, event: dict, user_id: int) -> dict:
+    """Страница истории чата, от новых к старым, по курсору (created_at, id)"""
+    params = event.get('queryStringParameters', {})
+    chat_id = params.get('chat_id')
+    if not chat_id:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'chat_id обязателен'}),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        before_id = int(params['before_id']) if params.get('before_id') else None
+        after_id = int(params['after_id']) if params.get('after_id') else None
+        limit = int(params.get('limit') or MESSAGES_PAGE_SIZE)
+    except ValueError:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Некорректные параметры пагинации'}),
+            'isBase64Encoded': False
+        }
+    
+    if before_id and after_id:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Укажите либо before_id, либо after_id'}),
+            'isBase64Encoded': False
+        }
+    
+    limit = max(1, min(limit, MESSAGES_PAGE_MAX))
+    
     cur = conn.cursor()
     
     cur.execute(
-        "SELECT id FROM chat_participants WHERE chat_id = %s AND user_id = %s",
+        """SELECT c.change_seq, (
+            SELECT MAX(u.updated_at) FROM chat_participants p
+            INNER JOIN users u ON u.id = p.user_id
+            WHERE p.chat_id = c.id
+        )
+        FROM chat_participants cp
+        INNER JOIN chats c ON c.id = cp.chat_id
+        WHERE cp.chat_id = %s AND cp.user_id = %s""",
         (chat_id, user_id)
     )
-    if not cur.fetchone():
+    row = cur.fetchone()
+    if not row:
         cur.close()
-        conn.close()
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -276,18 +781,37 @@ def get_messages(user_id: int, chat_id: str) -> dict:
             'isBase64Encoded': False
         }
     
-    cur.execute(
-        """SELECT m.id, m.content, m.sender_id, m.created_at,
-        u.username, u.display_name, u.avatar_url
-        FROM messages m
-        INNER JOIN users u ON u.id = m.sender_id
-        WHERE m.chat_id = %s
-        ORDER BY m.created_at ASC""",
-        (chat_id,)
-    )
+    etag = make_etag('messages', chat_id, row[0], row[1], before_id, after_id, limit)
+    if etag_matches(event, etag):
+        cur.close()
+        return not_modified(etag)
+    
+    cursor_key = None
+    if after_id or before_id:
+        cursor_key = find_message_key(cur, chat_id, after_id or before_id)
+    
+    rows = []
+    if after_id and cursor_key:
+        rows = read_archived_messages(cur, chat_id, cursor_key, limit + 1, descending=False)
+        if len(rows) <= limit:
+            rows += read_live_messages(cur, chat_id, cursor_key, limit + 1 - len(rows), descending=False)
+    elif cursor_key or not (before_id or after_id):
+        rows = read_live_messages(cur, chat_id, cursor_key, limit + 1, descending=True)
+        if len(rows) <= limit:
+            boundary = (rows[-1][3], rows[-1][0]) if rows else cursor_key
+            rows += read_archived_messages(cur, chat_id, boundary, limit + 1 - len(rows), descending=True)
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if after_id:
+        rows.reverse()
+    
+    next_cursor = None
+    if has_more:
+        next_cursor = rows[0][0] if after_id else rows[-1][0]
     
     messages = []
-    for row in cur.fetchall():
+    for row in rows:
         messages.append({
             'id': row[0],
             'content': row[1],
@@ -296,32 +820,462 @@ def get_messages(user_id: int, chat_id: str) -> dict:
             'sender': {
                 'username': row[4],
                 'display_name': row[5],
-                'avatar_url': row[6]
+                'avatar_url': row[6],
+                'avatars': row[7]
             }
         })
     
     cur.close()
-    conn.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'Cache-Control': 'no-cache',
+            'ETag': etag
+        },
+        'body': dump_json({'messages': messages, 'next_cursor': next_cursor, 'has_more': has_more}),
+        'isBase64Encoded': False
+    }
+
+def read_live_messages(cur, chat_id, cursor_key: tuple, limit: int, descending: bool) -> list:
+    order = 'DESC' if descending else 'ASC'
+    cursor_filter = ''
+    params = [chat_id]
+    if cursor_key:
+        if descending:
+            cursor_filter = 'AND m.created_at <= %s AND (m.created_at, m.id) < (%s, %s)'
+        else:
+            cursor_filter = 'AND m.created_at >= %s AND (m.created_at, m.id) > (%s, %s)'
+        params += [cursor_key[0], cursor_key[0], cursor_key[1]]
+    
+    cur.execute(
+        f"""SELECT m.id, m.content, m.sender_id, m.created_at,
+        u.username, u.display_name, u.avatar_url, u.avatars
+        FROM messages m
+        INNER JOIN users u ON u.id = m.sender_id
+        WHERE m.chat_id = %s {cursor_filter}
+        ORDER BY m.created_at {order}, m.id {order}
+        LIMIT %s""",
+        params + [limit]
+    )
+    return cur.fetchall()
+
+def find_message_key(cur, chat_id, message_id: int) -> tuple:
+    """(created_at, id) сообщения — из живых партиций или из архива"""
+    cur.execute(
+        "SELECT created_at, id FROM messages WHERE id = %s AND chat_id = %s",
+        (message_id, chat_id)
+    )
+    row = cur.fetchone()
+    if row:
+        return row
+    
+    cur.execute(
+        """SELECT object_key FROM message_archive_chunks
+        WHERE chat_id = %s AND %s BETWEEN min_message_id AND max_message_id""",
+        (chat_id, message_id)
+    )
+    for (object_key,) in cur.fetchall():
+        for message in load_archive_chunk(object_key):
+            if message['id'] == message_id:
+                return message['created_at'], message['id']
+    return None
+
+def read_archived_messages(cur, chat_id, boundary: tuple, limit: int, descending: bool) -> list:
+    """Сообщения из выгруженных в хранилище партиций, по ту сторону boundary"""
+    if descending:
+        cur.execute(
+            """SELECT object_key FROM message_archive_chunks
+            WHERE chat_id = %s AND (%s::timestamp IS NULL OR first_created_at <= %s)
+            ORDER BY first_created_at DESC""",
+            (chat_id, boundary[0] if boundary else None, boundary[0] if boundary else None)
+        )
+    else:
+        cur.execute(
+            """SELECT object_key FROM message_archive_chunks
+            WHERE chat_id = %s AND last_created_at >= %s
+            ORDER BY first_created_at ASC""",
+            (chat_id, boundary[0])
+        )
+    object_keys = [row[0] for row in cur.fetchall()]
+    
+    messages = []
+    for object_key in object_keys:
+        chunk = load_archive_chunk(object_key)
+        if descending:
+            chunk = [m for m in reversed(chunk) if not boundary or (m['created_at'], m['id']) < boundary]
+        else:
+            chunk = [m for m in chunk if (m['created_at'], m['id']) > boundary]
+        messages += chunk[:limit - len(messages)]
+        if len(messages) >= limit:
+            break
+    
+    if not messages:
+        return []
+    
+    cur.execute(
+        "SELECT id, username, display_name, avatar_url, avatars FROM users WHERE id = ANY(%s)",
+        (list({m['sender_id'] for m in messages}),)
+    )
+    senders = {row[0]: row[1:] for row in cur.fetchall()}
+    
+    return [
+        (m['id'], m['content'], m['sender_id'], m['created_at']) + senders.get(m['sender_id'], (None, None, None, None))
+        for m in messages
+    ]
+
+def load_archive_chunk(object_key: str) -> list:
+    if object_key in _archive_cache:
+        _archive_cache.move_to_end(object_key)
+        return _archive_cache[object_key]
+    
+    obj = get_s3_client().get_object(Bucket=ARCHIVE_BUCKET, Key=object_key)
+    messages = []
+    for line in gzip.decompress(obj['Body'].read()).decode('utf-8').splitlines():
+        message = json.loads(line)
+        message['created_at'] = datetime.fromisoformat(message['created_at'])
+        messages.append(message)
+    
+    _archive_cache[object_key] = messages
+    if len(_archive_cache) > ARCHIVE_CACHE_SIZE:
+        _archive_cache.popitem(last=False)
+    return messages
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+        )
+    return _s3_client
+
+def search_messages(conn, user_id: int, params: dict) -> dict:
+    """Полнотекстовый поиск по сообщениям чатов пользователя, страницы по (rank, id).
+    
+    Ищет только в живых партициях: месяцы, выгруженные в S3, не индексируются. Если в чатах пользователя
+    есть архив, ответ помечается partial, а searched_from — начало первого неархивного месяца."""
+    query = (params.get('q') or '').strip()
+    if len(query) < 2:
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'messages': [], 'next_cursor': None}),
+            'isBase64Encoded': False
+        }
+    
+    cursor = None
+    if params.get('cursor'):
+        cursor = decode_search_cursor(params['cursor'])
+        if cursor is None:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Некорректный курсор поиска'}),
+                'isBase64Encoded': False
+            }
+    
+    try:
+        limit = max(1, min(int(params.get('limit') or SEARCH_PAGE_SIZE), SEARCH_PAGE_MAX))
+    except ValueError:
+        limit = SEARCH_PAGE_SIZE
+    
+    cur = conn.cursor()
+    cur.execute(
+        f"""WITH q AS (
+            SELECT websearch_to_tsquery('russian', %(q)s) || websearch_to_tsquery('simple', %(q)s) AS query
+        ),
+        page AS (
+            SELECT m.id, m.chat_id, m.sender_id, m.content, m.created_at,
+            ts_rank(m.content_tsv, q.query)::float8 AS rank
+            FROM messages m, q
+            WHERE m.content_tsv @@ q.query
+            AND m.chat_id IN (SELECT chat_id FROM chat_participants WHERE user_id = %(user_id)s)
+            {'AND (ts_rank(m.content_tsv, q.query)::float8, m.id) < (%(rank)s, %(id)s)' if cursor else ''}
+            ORDER BY rank DESC, m.id DESC
+            LIMIT %(limit)s
+        )
+        SELECT page.id, page.chat_id, page.sender_id, page.created_at, page.rank,
+        ts_headline('russian', page.content, q.query, %(headline_options)s),
+        u.username, u.display_name, u.avatar_url, u.avatars
+        FROM page
+        CROSS JOIN q
+        INNER JOIN users u ON u.id = page.sender_id
+        ORDER BY page.rank DESC, page.id DESC""",
+        {
+            'q': query,
+            'user_id': user_id,
+            'rank': cursor[0] if cursor else None,
+            'id': cursor[1] if cursor else None,
+            'limit': limit + 1,
+            'headline_options': SEARCH_HEADLINE_OPTIONS
+        }
+    )
+    rows = cur.fetchall()
+    
+    cur.execute(
+        """SELECT MAX(a.range_end)
+        FROM message_archive_chunks c
+        INNER JOIN message_archives a ON a.id = c.archive_id
+        WHERE c.chat_id IN (SELECT chat_id FROM chat_participants WHERE user_id = %s)""",
+        (user_id,)
+    )
+    searched_from = cur.fetchone()[0]
+    cur.close()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    messages = []
+    for row in rows:
+        messages.append({
+            'id': row[0],
+            'chat_id': row[1],
+            'sender_id': row[2],
+            'created_at': row[3].isoformat() if row[3] else None,
+            'rank': row[4],
+            'snippet': row[5],
+            'sender': {
+                'username': row[6],
+                'display_name': row[7],
+                'avatar_url': row[8],
+                'avatars': row[9]
+            }
+        })
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'messages': messages}),
+        'body': dump_json({
+            'messages': messages,
+            'next_cursor': encode_search_cursor(rows[-1][4], rows[-1][0]) if has_more else None,
+            'partial': searched_from is not None,
+            'searched_from': searched_from.isoformat() if searched_from else None
+        }),
         'isBase64Encoded': False
     }
 
-def list_contacts(user_id: int) -> dict:
-    conn = get_db_connection()
+def encode_search_cursor(rank: float, message_id: int) -> str:
+    raw = f'{rank!r}:{message_id}'.encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_search_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        rank, message_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii').split(':')
+        return float(rank), int(message_id)
+    except (ValueError, UnicodeError):
+        return None
+
+def sync_changes(conn, user_id: int, params: dict) -> dict:
+    """Чаты, сообщения и контакты, изменившиеся после курсора since"""
+    since = None
+    if params.get('since'):
+        since = decode_sync_cursor(params['since'])
+        if since is None:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Некорректный курсор синхронизации'}),
+                'isBase64Encoded': False
+            }
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dump_json(collect_changes(conn, user_id, since)),
+        'isBase64Encoded': False
+    }
+
+def wait_for_changes(conn, user_id: int, params: dict) -> dict:
+    """Long-poll: ждёт NOTIFY по каналу пользователя и возвращает изменения после since.
+    
+    NOTIFY, пришедший, пока шёл collect_changes, psycopg2 уже сложил в conn.notifies; сокет при этом
+    молчит, поэтому очередь проверяется до select, иначе запрос проспал бы весь таймаут."""
+    if not params.get('since'):
+        return sync_changes(conn, user_id, params)
+    
+    since = decode_sync_cursor(params['since'])
+    if since is None:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Некорректный курсор синхронизации'}),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        timeout = min(max(float(params.get('timeout') or WAIT_TIMEOUT_MAX), 0), WAIT_TIMEOUT_MAX)
+    except ValueError:
+        timeout = WAIT_TIMEOUT_MAX
+    
+    channel = f'chat_user_{int(user_id)}'
+    cur = conn.cursor()
+    conn.commit()
+    cur.execute(f'LISTEN {channel}')
+    conn.commit()
+    
+    try:
+        changes = collect_changes(conn, user_id, since)
+        conn.commit()
+        
+        deadline = time.monotonic() + timeout
+        deferred = False
+        while not has_changes(changes):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            
+            if not conn.notifies:
+                ready = select.select([conn], [], [], min(remaining, SYNC_DEFER_RETRY) if deferred else remaining) != ([], [], [])
+                if ready:
+                    conn.poll()
+                if not conn.notifies and not deferred:
+                    if ready:
+                        continue
+                    break
+            
+            conn.notifies.clear()
+            changes = collect_changes(conn, user_id, since)
+            conn.commit()
+            deferred = not has_changes(changes)
+    finally:
+        cur.execute(f'UNLISTEN {channel}')
+        conn.commit()
+        conn.notifies.clear()
+        cur.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dump_json(changes),
+        'isBase64Encoded': False
+    }
+
+def has_changes(changes: dict) -> bool:
+    return bool(changes['chats'] or changes['messages'] or changes['contacts'])
+
+def collect_changes(conn, user_id: int, since: tuple = None) -> dict:
+    """Изменения из завершённых транзакций: курсор (xid, seq) не заходит за xmin текущего снимка.
+    
+    Строки транзакций не старше xmin откладываются до следующего вызова: параллельная транзакция с
+    меньшим номером ещё может закоммититься, и курсор по голове change_seq её бы перепрыгнул."""
+    cur = conn.cursor()
+    cur.execute("SELECT pg_snapshot_xmin(pg_current_snapshot())::text::bigint")
+    horizon = cur.fetchone()[0]
+    
+    if since is not None and since[0] >= horizon:
+        cur.close()
+        return {'chats': [], 'messages': [], 'contacts': [], 'cursor': encode_sync_cursor(since), 'has_more': False}
+    
+    window = (since[0], horizon) if since is not None else None
+    chats = fetch_chats(cur, user_id, window)
+    contacts = fetch_contacts(cur, user_id, window)
+    
+    messages = []
+    has_more = False
+    cursor = (horizon, 0)
+    if since is not None:
+        cur.execute(
+            """SELECT m.id, m.chat_id, m.content, m.sender_id, m.created_at,
+            u.username, u.display_name, u.avatar_url, m.change_xid, m.change_seq, u.avatars
+            FROM chat_participants cp
+            INNER JOIN messages m ON m.chat_id = cp.chat_id
+            AND (m.change_xid, m.change_seq) > (%s, %s) AND m.change_xid < %s
+            INNER JOIN users u ON u.id = m.sender_id
+            WHERE cp.user_id = %s
+            ORDER BY m.change_xid, m.change_seq
+            LIMIT %s""",
+            (since[0], since[1], horizon, user_id, SYNC_MESSAGES_LIMIT + 1)
+        )
+        rows = cur.fetchall()
+        
+        has_more = len(rows) > SYNC_MESSAGES_LIMIT
+        rows = rows[:SYNC_MESSAGES_LIMIT]
+        if has_more:
+            cursor = (rows[-1][8], rows[-1][9])
+        
+        for row in rows:
+            messages.append({
+                'id': row[0],
+                'chat_id': row[1],
+                'content': row[2],
+                'sender_id': row[3],
+                'created_at': row[4].isoformat() if row[4] else None,
+                'sender': {
+                    'username': row[5],
+                    'display_name': row[6],
+                    'avatar_url': row[7],
+                    'avatars': row[10]
+                }
+            })
+    
+    cur.close()
+    
+    return {
+        'chats': chats,
+        'messages': messages,
+        'contacts': contacts,
+        'cursor': encode_sync_cursor(cursor),
+        'has_more': has_more
+    }
+
+def encode_sync_cursor(position: tuple) -> str:
+    return base64.urlsafe_b64encode(f'{position[0]}:{position[1]}'.encode('ascii')).decode('ascii').rstrip('=')
+
+def decode_sync_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        xid, seq = base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii').split(':')
+        return int(xid), int(seq)
+    except (ValueError, UnicodeError):
+        return None
+
+def list_contacts(conn, event: dict, user_id: int) -> dict:
     cur = conn.cursor()
     
     cur.execute(
-        """SELECT u.id, u.username, u.display_name, u.avatar_url, c.added_at
+        """SELECT COUNT(*), MAX(c.change_seq), MAX(u.updated_at)
         FROM contacts c
         INNER JOIN users u ON u.id = c.contact_user_id
-        WHERE c.user_id = %s
-        ORDER BY c.added_at DESC""",
+        WHERE c.user_id = %s""",
         (user_id,)
     )
+    etag = make_etag('contacts', user_id, *cur.fetchone())
+    if etag_matches(event, etag):
+        cur.close()
+        return not_modified(etag)
+    
+    contacts = fetch_contacts(cur, user_id)
+    cur.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'Cache-Control': 'no-cache',
+            'ETag': etag
+        },
+        'body': dump_json({'contacts': contacts}),
+        'isBase64Encoded': False
+    }
+
+def fetch_contacts(cur, user_id: int, window: tuple = None) -> list:
+    since_filter = 'AND c.change_xid >= %s AND c.change_xid < %s' if window else ''
+    cur.execute(
+        f"""SELECT u.id, u.username, u.display_name, u.avatar_url, c.added_at, u.avatars
+        FROM contacts c
+        INNER JOIN users u ON u.id = c.contact_user_id
+        WHERE c.user_id = %s {since_filter}
+        ORDER BY c.added_at DESC""",
+        (user_id, *window) if window else (user_id,)
+    )
     
     contacts = []
     for row in cur.fetchall():
@@ -330,20 +1284,12 @@ def list_contacts(user_id: int) -> dict:
             'username': row[1],
             'display_name': row[2],
             'avatar_url': row[3],
+            'avatars': row[5],
             'added_at': row[4].isoformat() if row[4] else None
         })
-    
-    cur.close()
-    conn.close()
-    
-    return {
-        'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'contacts': contacts}),
-        'isBase64Encoded': False
-    }
+    return contacts
 
-def add_contact(event: dict, user_id: int) -> dict:
+def add_contact(conn, event: dict, user_id: int) -> dict:
     body = json.loads(event.get('body', '{}'))
     contact_user_id = body.get('user_id')
     
@@ -363,13 +1309,11 @@ def add_contact(event: dict, user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
     cur = conn.cursor()
     
     cur.execute("SELECT id FROM users WHERE id = %s", (contact_user_id,))
     if not cur.fetchone():
         cur.close()
-        conn.close()
         return {
             'statusCode': 404,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -383,7 +1327,6 @@ def add_contact(event: dict, user_id: int) -> dict:
     )
     if cur.fetchone():
         cur.close()
-        conn.close()
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -397,7 +1340,6 @@ def add_contact(event: dict, user_id: int) -> dict:
     )
     conn.commit()
     cur.close()
-    conn.close()
     
     return {
         'statusCode': 200,
@@ -406,36 +1348,283 @@ def add_contact(event: dict, user_id: int) -> dict:
         'isBase64Encoded': False
     }
 
-def get_user_from_token(event: dict) -> int:
+def dump_json(data) -> str:
+    """Тело ответа: тот же вывод, что json.dumps, но без проверки циклов.
+    
+    Тела собираются заново из строк выборки и циклов не содержат, а проверка ссылок стоит
+    5-15% времени кодирования (см. benchmarks/serialization.py)."""
+    return json.dumps(data, check_circular=False)
+
+def compress_response(event: dict, response: dict) -> dict:
+    """gzip/brotli для крупных JSON-ответов по Accept-Encoding клиента"""
+    body = response.get('body')
+    if response.get('isBase64Encoded') or not body or len(body) < COMPRESS_MIN_BYTES:
+        return response
+    
+    encoding = negotiate_encoding(get_header(event, 'Accept-Encoding'))
+    if not encoding:
+        return response
+    
+    raw = body.encode('utf-8')
+    if encoding == 'br':
+        compressed = brotli.compress(raw, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(raw, compresslevel=GZIP_LEVEL)
+    
+    headers = dict(response.get('headers', {}))
+    headers['Content-Encoding'] = encoding
+    headers['Vary'] = 'Accept-Encoding'
+    if 'ETag' in headers:
+        headers['ETag'] = headers['ETag'][:-1] + f'-{encoding}"'
+    
+    return {
+        **response,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    
+    if brotli and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+def make_etag(*version) -> str:
+    digest = hashlib.sha256(':'.join(str(part) for part in version).encode('utf-8')).hexdigest()
+    return f'"{digest[:32]}"'
+
+def etag_matches(event: dict, etag: str) -> bool:
+    header = get_header(event, 'If-None-Match')
+    if not header:
+        return False
+    tags = [tag.strip().replace('-gzip"', '"').replace('-br"', '"') for tag in header.split(',')]
+    return header.strip() == '*' or etag in tags
+
+def not_modified(etag: str) -> dict:
+    return {
+        'statusCode': 304,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'Cache-Control': 'no-cache',
+            'ETag': etag
+        },
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+def get_header(event: dict, name: str) -> str:
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return ''
+
+def get_auth_token(event: dict) -> str:
     auth_header = event.get('headers', {}).get('X-Authorization', '')
+    return auth_header.replace('Bearer ', '')
+
+def get_principal(conn, event: dict) -> dict:
+    """Кто делает запрос: claims подписанного access-токена (uid, role, sid, ver, exp).
+    
+    Загружается один раз в начале запроса, все проверки прав берут роль отсюда; ни sessions,
+    ни users на этом пути не читаются."""
+    claims = verify_access_token(get_auth_token(event))
     
-    if not auth_header:
+    if not claims or 'ver' not in claims:
         return None
     
-    token = auth_header.replace('Bearer ', '')
+    sync_revocations(conn)
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with _revocation_lock:
+        revoked_user = _revoked_users.get(claims['uid'])
+        revoked_session = _revoked_sessions.get(claims['sid'])
     
-    cur.execute(
-        "SELECT user_id, expires_at FROM sessions WHERE token = %s",
-        (token,)
-    )
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    if revoked_user and revoked_user[0] > claims['ver']:
+        return None
+    if revoked_session:
+        return None
     
-    if not row:
+    return claims
+
+def verify_access_token(token: str) -> dict:
+    if not token or not ACCESS_TOKEN_SECRET or token.count('.') != 1:
+        return None
+    
+    payload, signature = token.split('.')
+    expected = hmac.new(ACCESS_TOKEN_SECRET.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).digest()
+    try:
+        if not hmac.compare_digest(decode_token_part(signature), expected):
+            return None
+        claims = json.loads(decode_token_part(payload))
+    except ValueError:
         return None
     
-    if datetime.now() > row[1]:
+    if claims['exp'] < time.time():
         return None
     
-    return row[0]
+    return claims
+
+def decode_token_part(part: str) -> bytes:
+    return base64.urlsafe_b64decode(part + '=' * (-len(part) % 4))
+
+def sync_revocations(conn):
+    """Не чаще раза в REVOCATION_CHECK_INTERVAL секунд дочитывает auth_invalidations в список отзыва.
+    
+    Кроме id после последнего прочитанного перечитываются строки за REVOCATION_LATE_COMMIT_WINDOW секунд:
+    BIGSERIAL выдаёт id до коммита, и бан, закоммиченный позже строки с большим id, иначе был бы пропущен."""
+    now = time.monotonic()
+    with _revocation_lock:
+        if now - _revocation_state['checked_at'] < REVOCATION_CHECK_INTERVAL:
+            return
+        _revocation_state['checked_at'] = now
+        last_id = _revocation_state['invalidation_id']
+    
+    cur = conn.cursor()
+    if last_id is None:
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM auth_invalidations")
+        head = cur.fetchone()[0]
+        cur.execute(
+            """SELECT id, user_id, session_id, token_version FROM auth_invalidations
+            WHERE created_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            ORDER BY id""",
+            (ACCESS_TOKEN_TTL,)
+        )
+    else:
+        head = last_id
+        cur.execute(
+            """SELECT id, user_id, session_id, token_version FROM auth_invalidations
+            WHERE id > %s OR created_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            ORDER BY id""",
+            (last_id, REVOCATION_LATE_COMMIT_WINDOW)
+        )
+    rows = cur.fetchall()
+    cur.close()
+    
+    with _revocation_lock:
+        for invalidation_id, user_id, session_id, token_version in rows:
+            if user_id is not None:
+                _revoked_users[user_id] = (max(token_version or 0, _revoked_users.get(user_id, (0,))[0]), now)
+            if session_id is not None:
+                _revoked_sessions[session_id] = (invalidation_id, now)
+            head = max(head, invalidation_id)
+        _revocation_state['invalidation_id'] = max(head, _revocation_state['invalidation_id'] or 0)
+        
+        for revoked in (_revoked_users, _revoked_sessions):
+            for key in [key for key, entry in revoked.items() if now - entry[1] > ACCESS_TOKEN_TTL]:
+                del revoked[key]
+
+def get_revocation_stats() -> dict:
+    with _revocation_lock:
+        return {'users': len(_revoked_users), 'sessions': len(_revoked_sessions)}
+
+_revocation_lock = threading.Lock()
+_revoked_users = {}
+_revoked_sessions = {}
+_revocation_state = {'invalidation_id': None, 'checked_at': 0.0}
+
+_pool_lock = threading.Condition()
+_pool_idle = []
+_pool_born = {}
+_pool_stats = {'created': 0, 'reused': 0, 'discarded': 0, 'health_check_failures': 0, 'waits': 0}
 
 def get_db_connection():
+    """Выдаёт соединение из пула, живущего между тёплыми вызовами функции"""
+    with _pool_lock:
+        while True:
+            while _pool_idle:
+                conn, last_used = _pool_idle.pop()
+                if is_connection_alive(conn, last_used):
+                    _pool_stats['reused'] += 1
+                    return conn
+                discard_db_connection(conn)
+            
+            if len(_pool_born) < DB_POOL_MAX_SIZE:
+                break
+            
+            _pool_stats['waits'] += 1
+            if not _pool_lock.wait(timeout=DB_POOL_TIMEOUT):
+                raise psycopg2.pool.PoolError('connection pool exhausted')
+        
+        conn = open_db_connection()
+        while len(_pool_born) < DB_POOL_MIN_SIZE:
+            _pool_idle.append((open_db_connection(), time.monotonic()))
+        return conn
+
+def release_db_connection(conn):
+    with _pool_lock:
+        if conn not in _pool_born:
+            return
+        
+        try:
+            if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            pass
+        
+        expired = time.monotonic() - _pool_born[conn] > DB_POOL_MAX_LIFETIME
+        if conn.closed or expired or len(_pool_idle) >= DB_POOL_MAX_SIZE:
+            discard_db_connection(conn)
+        else:
+            _pool_idle.append((conn, time.monotonic()))
+        _pool_lock.notify()
+
+def open_db_connection():
     dsn = os.environ.get('DATABASE_URL')
     schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
     
     conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
-    return conn
\ No newline at end of file
+    _pool_born[conn] = time.monotonic()
+    _pool_stats['created'] += 1
+    return conn
+
+def discard_db_connection(conn):
+    _pool_born.pop(conn, None)
+    _pool_stats['discarded'] += 1
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def is_connection_alive(conn, last_used: float) -> bool:
+    if conn.closed:
+        return False
+    
+    if time.monotonic() - _pool_born[conn] > DB_POOL_MAX_LIFETIME:
+        return False
+    
+    if time.monotonic() - last_used < DB_POOL_CHECK_IDLE:
+        return True
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        _pool_stats['health_check_failures'] += 1
+        return False
+
+def get_pool_stats() -> dict:
+    with _pool_lock:
+        return {
+            'size': len(_pool_born),
+            'idle': len(_pool_idle),
+            'in_use': len(_pool_born) - len(_pool_idle),
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            **_pool_stats
+        }
\ No newline at end of file
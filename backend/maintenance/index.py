@@ -0,0 +1,559 @@
+import json
+import os
+import re
+import gzip
+import hmac
+import io
+import threading
+import time
+import boto3
+import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2 import sql
+from datetime import date, datetime, timedelta
+from PIL import Image, ImageOps
+
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_MAX_LIFETIME = int(os.environ.get('DB_POOL_MAX_LIFETIME', '600'))
+DB_POOL_CHECK_IDLE = int(os.environ.get('DB_POOL_CHECK_IDLE', '30'))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '10'))
+
+PARTITIONS_AHEAD_MONTHS = 3
+ARCHIVE_AFTER_MONTHS = int(os.environ.get('ARCHIVE_AFTER_MONTHS', '12'))
+ARCHIVE_FETCH_SIZE = 5000
+AUTH_INVALIDATIONS_RETENTION_HOURS = 24
+REAP_BATCH_SIZE = 1000
+REAP_MAX_BATCHES = 100
+STATS_SHARDS = 16
+STATS_RECONCILE_DAYS = 3
+AVATAR_SIZES = (48, 96, 256)
+AVATAR_WEBP_QUALITY = 80
+AVATAR_JPEG_QUALITY = 85
+AVATAR_MAX_PIXELS = 40_000_000
+AVATAR_JOBS_PER_RUN = 50
+AVATAR_JOB_MAX_ATTEMPTS = 3
+AVATAR_JOB_LEASE_SECONDS = 300
+AVATAR_JOBS_RETENTION_DAYS = 7
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+ARCHIVE_BUCKET = os.environ.get('ARCHIVE_BUCKET', 'files')
+AVATAR_BUCKET = 'files'
+
+Image.MAX_IMAGE_PIXELS = AVATAR_MAX_PIXELS
+
+_s3_client = None
+
+def handler(event: dict, context) -> dict:
+    """Плановое обслуживание БД: партиции сообщений, архив старых месяцев, чистка истёкших сессий, сверка статистики, миниатюры аватаров"""
+    if 'httpMethod' not in event:
+        conn = get_db_connection()
+        try:
+            return run_scheduled(conn)
+        finally:
+            release_db_connection(conn)
+    
+    method = event.get('httpMethod', 'GET')
+    
+    if method == 'OPTIONS':
+        return {
+            'statusCode': 200,
+            'headers': {
+                'Access-Control-Allow-Origin': '*',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
+                'Access-Control-Allow-Headers': 'Content-Type, X-Maintenance-Token'
+            },
+            'body': '',
+            'isBase64Encoded': False
+        }
+    
+    action = (event.get('queryStringParameters') or {}).get('action', '')
+    
+    if method == 'GET' and action == 'health':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'status': 'ok', 'pool': get_pool_stats()}),
+            'isBase64Encoded': False
+        }
+    
+    expected_token = os.environ.get('MAINTENANCE_TOKEN', '')
+    token = event.get('headers', {}).get('X-Maintenance-Token', '')
+    if not expected_token or not hmac.compare_digest(token, expected_token):
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Доступ запрещён'}),
+            'isBase64Encoded': False
+        }
+    
+    if method == 'POST' and action in ('run', 'partitions', 'archive', 'reap', 'stats', 'avatars'):
+        conn = get_db_connection()
+        try:
+            if action == 'run':
+                return run_scheduled(conn)
+            elif action == 'partitions':
+                result = {'partitions_created': ensure_partitions(conn)}
+            elif action == 'archive':
+                result = {'archived': archive_messages(conn)}
+            elif action == 'reap':
+                result = {'reaped': reap_expired(conn)}
+            elif action == 'stats':
+                result = {'stats_reconciled': reconcile_daily_stats(conn)}
+            elif action == 'avatars':
+                result = {'avatars': process_avatar_jobs(conn)}
+        finally:
+            release_db_connection(conn)
+        
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps(result),
+            'isBase64Encoded': False
+        }
+    
+    return {
+        'statusCode': 400,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'error': 'Invalid action'}),
+        'isBase64Encoded': False
+    }
+
+def run_scheduled(conn) -> dict:
+    result = {
+        'partitions_created': ensure_partitions(conn),
+        'archived': archive_messages(conn),
+        'reaped': reap_expired(conn),
+        'stats_reconciled': reconcile_daily_stats(conn),
+        'avatars': process_avatar_jobs(conn)
+    }
+    print(f"Maintenance: {json.dumps(result)}")
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps(result),
+        'isBase64Encoded': False
+    }
+
+def ensure_partitions(conn) -> int:
+    now = datetime.now()
+    cur = conn.cursor()
+    cur.execute(
+        "SELECT ensure_messages_partitions(%s, %s)",
+        (now, now + timedelta(days=31 * PARTITIONS_AHEAD_MONTHS))
+    )
+    created = cur.fetchone()[0]
+    conn.commit()
+    cur.close()
+    return created
+
+def reap_expired(conn) -> dict:
+    """Удаляет истёкшие сессии и коды подтверждения, а также отслужившие записи auth_invalidations.
+    
+    Записи отзыва нужны, лишь пока живут выданные до них access-токены (ACCESS_TOKEN_TTL); сутки — с запасом."""
+    now = datetime.now()
+    return {
+        'sessions': reap_table(conn, 'sessions', 'expires_at', now),
+        'verification_codes': reap_table(conn, 'verification_codes', 'expires_at', now),
+        'auth_invalidations': reap_table(
+            conn, 'auth_invalidations', 'created_at', now - timedelta(hours=AUTH_INVALIDATIONS_RETENTION_HOURS)
+        ),
+        'avatar_jobs': reap_table(conn, 'avatar_jobs', 'processed_at', now - timedelta(days=AVATAR_JOBS_RETENTION_DAYS))
+    }
+
+def reap_table(conn, table: str, column: str, cutoff: datetime) -> int:
+    """Пачки по REAP_BATCH_SIZE с коммитом после каждой; SKIP LOCKED пропускает строки, занятые логином или refresh"""
+    cur = conn.cursor()
+    reclaimed = 0
+    
+    for _ in range(REAP_MAX_BATCHES):
+        cur.execute(
+            f"""DELETE FROM {table} WHERE id IN (
+                SELECT id FROM {table}
+                WHERE {column} < %s
+                LIMIT %s
+                FOR UPDATE SKIP LOCKED
+            )""",
+            (cutoff, REAP_BATCH_SIZE)
+        )
+        deleted = cur.rowcount
+        conn.commit()
+        reclaimed += deleted
+        
+        if deleted < REAP_BATCH_SIZE:
+            break
+    
+    cur.close()
+    return reclaimed
+
+def reconcile_daily_stats(conn) -> list:
+    """Пересчитывает счётчики daily_stats по messages и users за последние завершённые дни и за дни,
+    которые импорт пометил в daily_stats_dirty.
+    
+    Сегодняшний день не трогаем, чтобы не гоняться с живыми инкрементами. bans/unbans истории не имеют
+    и не сверяются."""
+    today = date.today()
+    cur = conn.cursor()
+    cur.execute("SELECT day, marked_at FROM daily_stats_dirty WHERE day < %s", (today,))
+    dirty = dict(cur.fetchall())
+    days = sorted(set(dirty) | {today - timedelta(days=offset) for offset in range(1, STATS_RECONCILE_DAYS + 1)})
+    
+    for day in days:
+        cur.execute(
+            """WITH sent AS (
+                SELECT MOD(sender_id, %(shards)s) AS shard, COUNT(*) AS messages_sent,
+                COUNT(DISTINCT sender_id) AS active_users
+                FROM messages
+                WHERE created_at >= %(day)s AND created_at < %(next_day)s AND sender_id IS NOT NULL
+                GROUP BY 1
+            ),
+            registered AS (
+                SELECT MOD(id, %(shards)s) AS shard, COUNT(*) AS registrations
+                FROM users
+                WHERE created_at >= %(day)s AND created_at < %(next_day)s
+                GROUP BY 1
+            )
+            INSERT INTO daily_stats (day, shard, messages_sent, active_users, registrations)
+            SELECT %(day)s, shards.shard, COALESCE(sent.messages_sent, 0), COALESCE(sent.active_users, 0),
+            COALESCE(registered.registrations, 0)
+            FROM generate_series(0, %(shards)s - 1) shards(shard)
+            LEFT JOIN sent ON sent.shard = shards.shard
+            LEFT JOIN registered ON registered.shard = shards.shard
+            ON CONFLICT (day, shard) DO UPDATE SET
+            messages_sent = EXCLUDED.messages_sent,
+            active_users = EXCLUDED.active_users,
+            registrations = EXCLUDED.registrations""",
+            {'day': day, 'next_day': day + timedelta(days=1), 'shards': STATS_SHARDS}
+        )
+        if day in dirty:
+            cur.execute("DELETE FROM daily_stats_dirty WHERE day = %s AND marked_at = %s", (day, dirty[day]))
+        conn.commit()
+    
+    cur.execute("DELETE FROM daily_active_users WHERE day < %s", (today - timedelta(days=1),))
+    conn.commit()
+    cur.close()
+    
+    return [day.isoformat() for day in days]
+
+def archive_messages(conn) -> list:
+    """Выгружает месячные партиции старше ARCHIVE_AFTER_MONTHS в хранилище и отсоединяет их"""
+    today = datetime.now()
+    month_index = today.year * 12 + today.month - 1 - ARCHIVE_AFTER_MONTHS
+    cutoff = datetime(month_index // 12, month_index % 12 + 1, 1)
+    
+    cur = conn.cursor()
+    cur.execute(
+        """SELECT c.relname FROM pg_inherits i
+        INNER JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'messages'::regclass
+        ORDER BY c.relname"""
+    )
+    partitions = [row[0] for row in cur.fetchall()]
+    cur.close()
+    conn.commit()
+    
+    archived = []
+    for partition_name in partitions:
+        match = re.fullmatch(r'messages_(\d{4})_(\d{2})', partition_name)
+        if not match:
+            continue
+        
+        range_start = datetime(int(match.group(1)), int(match.group(2)), 1)
+        next_month = range_start.year * 12 + range_start.month
+        range_end = datetime(next_month // 12, next_month % 12 + 1, 1)
+        if range_end > cutoff:
+            continue
+        
+        archived.append(archive_partition(conn, partition_name, range_start, range_end))
+    
+    return archived
+
+def archive_partition(conn, partition_name: str, range_start: datetime, range_end: datetime) -> dict:
+    """Каждый прогон пишет чанки под своими ключами: если месяц уже архивировался (партиция была
+    пересоздана до V0016), прежние объекты не перезаписываются, а строка message_archives дополняется"""
+    month = range_start.strftime('%Y_%m')
+    run = datetime.now().strftime('%Y%m%d%H%M%S')
+    chunks = []
+    
+    export = conn.cursor(name=f'archive_{month}')
+    export.itersize = ARCHIVE_FETCH_SIZE
+    export.execute(
+        sql.SQL(
+            """SELECT id, chat_id, sender_id, content, created_at
+            FROM {} ORDER BY chat_id, created_at, id"""
+        ).format(sql.Identifier(partition_name))
+    )
+    
+    chat_rows = []
+    for row in export:
+        if chat_rows and chat_rows[-1][1] != row[1]:
+            chunks.append(upload_archive_chunk(month, run, chat_rows))
+            chat_rows = []
+        chat_rows.append(row)
+    if chat_rows:
+        chunks.append(upload_archive_chunk(month, run, chat_rows))
+    export.close()
+    
+    cur = conn.cursor()
+    cur.execute(
+        """INSERT INTO message_archives (partition_name, range_start, range_end, message_count)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (partition_name) DO UPDATE SET
+        message_count = message_archives.message_count + EXCLUDED.message_count,
+        archived_at = CURRENT_TIMESTAMP
+        RETURNING id""",
+        (partition_name, range_start, range_end, sum(chunk['message_count'] for chunk in chunks))
+    )
+    archive_id = cur.fetchone()[0]
+    
+    for chunk in chunks:
+        cur.execute(
+            """INSERT INTO message_archive_chunks
+            (archive_id, chat_id, object_key, message_count, min_message_id, max_message_id,
+            first_created_at, last_created_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""",
+            (archive_id, chunk['chat_id'], chunk['object_key'], chunk['message_count'],
+             chunk['min_message_id'], chunk['max_message_id'],
+             chunk['first_created_at'], chunk['last_created_at'])
+        )
+    
+    cur.execute(sql.SQL("ALTER TABLE messages DETACH PARTITION {}").format(sql.Identifier(partition_name)))
+    cur.execute(sql.SQL("DROP TABLE {}").format(sql.Identifier(partition_name)))
+    conn.commit()
+    cur.close()
+    
+    return {
+        'partition': partition_name,
+        'chats': len(chunks),
+        'messages': sum(chunk['message_count'] for chunk in chunks)
+    }
+
+def upload_archive_chunk(month: str, run: str, rows: list) -> dict:
+    chat_id = rows[0][1]
+    lines = [
+        json.dumps({
+            'id': row[0],
+            'chat_id': row[1],
+            'sender_id': row[2],
+            'content': row[3],
+            'created_at': row[4].isoformat()
+        }, ensure_ascii=False)
+        for row in rows
+    ]
+    object_key = f'archive/messages/{month}/chat_{chat_id}_{run}.ndjson.gz'
+    
+    get_s3_client().put_object(
+        Bucket=ARCHIVE_BUCKET,
+        Key=object_key,
+        Body=gzip.compress('\n'.join(lines).encode('utf-8')),
+        ContentType='application/gzip'
+    )
+    
+    return {
+        'chat_id': chat_id,
+        'object_key': object_key,
+        'message_count': len(rows),
+        'min_message_id': min(row[0] for row in rows),
+        'max_message_id': max(row[0] for row in rows),
+        'first_created_at': rows[0][4],
+        'last_created_at': rows[-1][4]
+    }
+
+def process_avatar_jobs(conn) -> dict:
+    """Рендерит миниатюры из очереди avatar_jobs; SKIP LOCKED и аренда claimed_until позволяют параллельные запуски.
+    
+    Задание забирается и коммитится отдельной короткой транзакцией, рендер идёт вне транзакции, результат
+    пишется второй короткой: долгая транзакция держала бы xmin и горизонт sync. Задание, чей исходник уже
+    не текущий аватар пользователя, закрывается без работы."""
+    cur = conn.cursor()
+    result = {'processed': 0, 'skipped': 0, 'failed': 0}
+    
+    for _ in range(AVATAR_JOBS_PER_RUN):
+        now = datetime.now()
+        cur.execute(
+            """UPDATE avatar_jobs j SET attempts = j.attempts + 1, claimed_until = %s
+            FROM (
+                SELECT id FROM avatar_jobs
+                WHERE processed_at IS NULL AND attempts < %s AND (claimed_until IS NULL OR claimed_until < %s)
+                ORDER BY id
+                LIMIT 1
+                FOR UPDATE SKIP LOCKED
+            ) next
+            WHERE j.id = next.id
+            RETURNING j.id, j.user_id, j.source_key, j.source_url, (SELECT avatar_url FROM users WHERE id = j.user_id)""",
+            (now + timedelta(seconds=AVATAR_JOB_LEASE_SECONDS), AVATAR_JOB_MAX_ATTEMPTS, now)
+        )
+        job = cur.fetchone()
+        conn.commit()
+        if not job:
+            break
+        
+        job_id, user_id, source_key, source_url, current_url = job
+        if current_url != source_url:
+            cur.execute("UPDATE avatar_jobs SET processed_at = %s, claimed_until = NULL WHERE id = %s", (datetime.now(), job_id))
+            conn.commit()
+            result['skipped'] += 1
+            continue
+        
+        try:
+            avatars = render_avatar(user_id, source_key)
+        except Exception as e:
+            cur.execute(
+                "UPDATE avatar_jobs SET last_error = %s, claimed_until = NULL WHERE id = %s",
+                (str(e)[:500], job_id)
+            )
+            conn.commit()
+            result['failed'] += 1
+            continue
+        
+        cur.execute(
+            "UPDATE users SET avatars = %s, updated_at = %s WHERE id = %s AND avatar_url = %s",
+            (json.dumps(avatars), datetime.now(), user_id, source_url)
+        )
+        cur.execute("UPDATE avatar_jobs SET processed_at = %s, claimed_until = NULL WHERE id = %s", (datetime.now(), job_id))
+        conn.commit()
+        result['processed'] += 1
+    
+    cur.close()
+    return result
+
+def render_avatar(user_id: int, source_key: str) -> dict:
+    """Квадратные миниатюры AVATAR_SIZES в WebP и JPEG; EXIF учитывается для поворота и не сохраняется"""
+    s3 = get_s3_client()
+    source = s3.get_object(Bucket=AVATAR_BUCKET, Key=source_key)['Body'].read()
+    stem = source_key.rsplit('/', 1)[-1].rsplit('.', 1)[0]
+    cdn_prefix = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/"
+    
+    with Image.open(io.BytesIO(source)) as image:
+        image = ImageOps.exif_transpose(image).convert('RGBA')
+    
+    avatars = {}
+    for size in AVATAR_SIZES:
+        thumbnail = ImageOps.fit(image, (size, size), Image.LANCZOS)
+        flattened = Image.new('RGB', thumbnail.size, (255, 255, 255))
+        flattened.paste(thumbnail, mask=thumbnail.getchannel('A'))
+        
+        avatars[str(size)] = {}
+        for file_format, ext, rendition, options in (
+            ('WEBP', 'webp', thumbnail, {'quality': AVATAR_WEBP_QUALITY, 'method': 4}),
+            ('JPEG', 'jpeg', flattened, {'quality': AVATAR_JPEG_QUALITY, 'optimize': True, 'progressive': True})
+        ):
+            buffer = io.BytesIO()
+            rendition.save(buffer, file_format, **options)
+            object_key = f'avatars/{user_id}/{stem}_{size}.{ext}'
+            s3.put_object(
+                Bucket=AVATAR_BUCKET,
+                Key=object_key,
+                Body=buffer.getvalue(),
+                ContentType=f'image/{ext}',
+                CacheControl='public, max-age=31536000, immutable'
+            )
+            avatars[str(size)][ext] = cdn_prefix + object_key
+    
+    return avatars
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+        )
+    return _s3_client
+
+_pool_lock = threading.Condition()
+_pool_idle = []
+_pool_born = {}
+_pool_stats = {'created': 0, 'reused': 0, 'discarded': 0, 'health_check_failures': 0, 'waits': 0}
+
+def get_db_connection():
+    """Выдаёт соединение из пула, живущего между тёплыми вызовами функции"""
+    with _pool_lock:
+        while True:
+            while _pool_idle:
+                conn, last_used = _pool_idle.pop()
+                if is_connection_alive(conn, last_used):
+                    _pool_stats['reused'] += 1
+                    return conn
+                discard_db_connection(conn)
+            
+            if len(_pool_born) < DB_POOL_MAX_SIZE:
+                break
+            
+            _pool_stats['waits'] += 1
+            if not _pool_lock.wait(timeout=DB_POOL_TIMEOUT):
+                raise psycopg2.pool.PoolError('connection pool exhausted')
+        
+        conn = open_db_connection()
+        while len(_pool_born) < DB_POOL_MIN_SIZE:
+            _pool_idle.append((open_db_connection(), time.monotonic()))
+        return conn
+
+def release_db_connection(conn):
+    with _pool_lock:
+        if conn not in _pool_born:
+            return
+        
+        try:
+            if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            pass
+        
+        expired = time.monotonic() - _pool_born[conn] > DB_POOL_MAX_LIFETIME
+        if conn.closed or expired or len(_pool_idle) >= DB_POOL_MAX_SIZE:
+            discard_db_connection(conn)
+        else:
+            _pool_idle.append((conn, time.monotonic()))
+        _pool_lock.notify()
+
+def open_db_connection():
+    dsn = os.environ.get('DATABASE_URL')
+    schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
+    
+    conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
+    _pool_born[conn] = time.monotonic()
+    _pool_stats['created'] += 1
+    return conn
+
+def discard_db_connection(conn):
+    _pool_born.pop(conn, None)
+    _pool_stats['discarded'] += 1
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def is_connection_alive(conn, last_used: float) -> bool:
+    if conn.closed:
+        return False
+    
+    if time.monotonic() - _pool_born[conn] > DB_POOL_MAX_LIFETIME:
+        return False
+    
+    if time.monotonic() - last_used < DB_POOL_CHECK_IDLE:
+        return True
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        _pool_stats['health_check_failures'] += 1
+        return False
+
+def get_pool_stats() -> dict:
+    with _pool_lock:
+        return {
+            'size': len(_pool_born),
+            'idle': len(_pool_idle),
+            'in_use': len(_pool_born) - len(_pool_idle),
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            **_pool_stats
+        }
\ No newline at end of file
@@ -1,13 +1,40 @@
 import json
+import hashlib
+import hmac
 import os
+import threading
+import time
 import base64
+import re
 import uuid
 import boto3
+from botocore.exceptions import ClientError
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
 from datetime import datetime
 
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_MAX_LIFETIME = int(os.environ.get('DB_POOL_MAX_LIFETIME', '600'))
+DB_POOL_CHECK_IDLE = int(os.environ.get('DB_POOL_CHECK_IDLE', '30'))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '10'))
+
+ACCESS_TOKEN_SECRET = os.environ.get('ACCESS_TOKEN_SECRET', '')
+ACCESS_TOKEN_TTL = int(os.environ.get('ACCESS_TOKEN_TTL', '900'))
+REVOCATION_CHECK_INTERVAL = float(os.environ.get('REVOCATION_CHECK_INTERVAL', '2'))
+REVOCATION_LATE_COMMIT_WINDOW = 60
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+AVATAR_BUCKET = 'files'
+AVATAR_MAX_BYTES = 5 * 1024 * 1024
+AVATAR_PRESIGN_TTL = 300
+AVATAR_CONTENT_TYPES = {'image/jpeg': 'jpeg', 'image/png': 'png', 'image/gif': 'gif', 'image/webp': 'webp'}
+
+_s3_client = None
+
 def handler(event: dict, context) -> dict:
-    """API для загрузки аватарок пользователей в S3"""
+    """API для загрузки аватарок: presign → загрузка прямо в S3 → confirm; base64 в теле оставлен для старых клиентов"""
     method = event.get('httpMethod', 'POST')
     
     if method == 'OPTIONS':
@@ -15,13 +42,23 @@ def handler(event: dict, context) -> dict:
             'statusCode': 200,
             'headers': {
                 'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'POST, OPTIONS',
+                'Access-Control-Allow-Methods': 'GET, POST, OPTIONS',
                 'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
+    action = (event.get('queryStringParameters') or {}).get('action', '')
+    
+    if method == 'GET' and action == 'health':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'status': 'ok', 'pool': get_pool_stats(), 'revocations': get_revocation_stats()}),
+            'isBase64Encoded': False
+        }
+    
     if method != 'POST':
         return {
             'statusCode': 405,
@@ -30,15 +67,135 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    user_id = get_user_from_token(event)
-    if not user_id:
+    conn = get_db_connection()
+    try:
+        user_id = get_user_from_token(conn, event)
+        if not user_id:
+            return {
+                'statusCode': 401,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Unauthorized'}),
+                'isBase64Encoded': False
+            }
+        
+        if action == 'presign':
+            return presign_avatar_upload(event, user_id)
+        if action == 'confirm':
+            return confirm_avatar_upload(conn, event, user_id)
+        return upload_avatar(conn, event, user_id)
+    finally:
+        release_db_connection(conn)
+
+def presign_avatar_upload(event: dict, user_id: int) -> dict:
+    """Presigned POST в avatars/{user_id}/: политика ограничивает ключ, Content-Type и размер"""
+    body = json.loads(event.get('body') or '{}')
+    content_type = body.get('content_type', '')
+    
+    if content_type not in AVATAR_CONTENT_TYPES:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Поддерживаются только JPEG, PNG, GIF и WebP'}),
+            'isBase64Encoded': False
+        }
+    
+    object_key = f'avatars/{user_id}/{uuid.uuid4()}.{AVATAR_CONTENT_TYPES[content_type]}'
+    presigned = get_s3_client().generate_presigned_post(
+        Bucket=AVATAR_BUCKET,
+        Key=object_key,
+        Fields={'Content-Type': content_type},
+        Conditions=[
+            {'Content-Type': content_type},
+            ['content-length-range', 1, AVATAR_MAX_BYTES]
+        ],
+        ExpiresIn=AVATAR_PRESIGN_TTL
+    )
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'url': presigned['url'],
+            'fields': presigned['fields'],
+            'key': object_key,
+            'expires_in': AVATAR_PRESIGN_TTL
+        }),
+        'isBase64Encoded': False
+    }
+
+def confirm_avatar_upload(conn, event: dict, user_id: int) -> dict:
+    """Проверяет загруженный объект (HEAD и сигнатура первых байт) и ставит его аватаром"""
+    body = json.loads(event.get('body') or '{}')
+    object_key = body.get('key', '')
+    
+    if not re.fullmatch(rf'avatars/{user_id}/[0-9a-f-]{{36}}\.(jpeg|png|gif|webp)', object_key):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Некорректный ключ загрузки'}),
+            'isBase64Encoded': False
+        }
+    
+    s3 = get_s3_client()
+    try:
+        head = s3.head_object(Bucket=AVATAR_BUCKET, Key=object_key)
+    except ClientError:
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Файл не загружен'}),
+            'isBase64Encoded': False
+        }
+    
+    signature = s3.get_object(Bucket=AVATAR_BUCKET, Key=object_key, Range='bytes=0-11')['Body'].read()
+    content_type = detect_image_type(signature)
+    
+    if head['ContentLength'] > AVATAR_MAX_BYTES or not content_type or content_type != head.get('ContentType'):
+        s3.delete_object(Bucket=AVATAR_BUCKET, Key=object_key)
         return {
-            'statusCode': 401,
+            'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'error': 'Unauthorized'}),
+            'body': json.dumps({'error': 'Файл не является изображением или превышает 5 МБ'}),
             'isBase64Encoded': False
         }
     
+    cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{object_key}"
+    
+    cur = conn.cursor()
+    set_avatar(cur, user_id, object_key, cdn_url)
+    conn.commit()
+    cur.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({'url': cdn_url}),
+        'isBase64Encoded': False
+    }
+
+def set_avatar(cur, user_id: int, object_key: str, cdn_url: str):
+    """Новый аватар и задание на миниатюры — одной транзакцией; до их готовности avatars пуст"""
+    cur.execute(
+        "UPDATE users SET avatar_url = %s, avatars = NULL, updated_at = %s WHERE id = %s",
+        (cdn_url, datetime.now(), user_id)
+    )
+    cur.execute(
+        "INSERT INTO avatar_jobs (user_id, source_key, source_url) VALUES (%s, %s, %s)",
+        (user_id, object_key, cdn_url)
+    )
+
+def detect_image_type(data: bytes) -> str:
+    if data[:3] == b'\xff\xd8\xff':
+        return 'image/jpeg'
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        return 'image/png'
+    if data[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+def upload_avatar(conn, event: dict, user_id: int) -> dict:
     body = json.loads(event.get('body', '{}'))
     image_data = body.get('image')
     
@@ -63,7 +220,7 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    if len(image_bytes) > 5 * 1024 * 1024:
+    if len(image_bytes) > AVATAR_MAX_BYTES:
         return {
             'statusCode': 400,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -71,24 +228,14 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    content_type = 'image/jpeg'
-    if image_bytes[:4] == b'\x89PNG':
-        content_type = 'image/png'
-    elif image_bytes[:3] == b'GIF':
-        content_type = 'image/gif'
+    content_type = detect_image_type(image_bytes[:12]) or 'image/jpeg'
     
-    file_extension = content_type.split('/')[1]
+    file_extension = AVATAR_CONTENT_TYPES[content_type]
     filename = f'avatars/{user_id}/{uuid.uuid4()}.{file_extension}'
     
     try:
-        s3 = boto3.client('s3',
-            endpoint_url='https://bucket.poehali.dev',
-            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
-            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
-        )
-        
-        s3.put_object(
-            Bucket='files',
+        get_s3_client().put_object(
+            Bucket=AVATAR_BUCKET,
             Key=filename,
             Body=image_bytes,
             ContentType=content_type
@@ -96,15 +243,10 @@ def handler(event: dict, context) -> dict:
         
         cdn_url = f"https://cdn.poehali.dev/projects/{os.environ['AWS_ACCESS_KEY_ID']}/bucket/{filename}"
         
-        conn = get_db_connection()
         cur = conn.cursor()
-        cur.execute(
-            "UPDATE users SET avatar_url = %s, updated_at = %s WHERE id = %s",
-            (cdn_url, datetime.now(), user_id)
-        )
+        set_avatar(cur, user_id, filename, cdn_url)
         conn.commit()
         cur.close()
-        conn.close()
         
         return {
             'statusCode': 200,
@@ -121,36 +263,213 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
 
-def get_user_from_token(event: dict) -> int:
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+        )
+    return _s3_client
+
+def get_auth_token(event: dict) -> str:
     auth_header = event.get('headers', {}).get('X-Authorization', '')
+    return auth_header.replace('Bearer ', '')
+
+def get_user_from_token(conn, event: dict) -> int:
+    principal = get_principal(conn, event)
+    return principal['uid'] if principal else None
+
+def get_principal(conn, event: dict) -> dict:
+    """Кто делает запрос: claims подписанного access-токена (uid, role, sid, ver, exp).
+    
+    Загружается один раз в начале запроса, все проверки прав берут роль отсюда; ни sessions,
+    ни users на этом пути не читаются."""
+    claims = verify_access_token(get_auth_token(event))
     
-    if not auth_header:
+    if not claims or 'ver' not in claims:
         return None
     
-    token = auth_header.replace('Bearer ', '')
+    sync_revocations(conn)
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    with _revocation_lock:
+        revoked_user = _revoked_users.get(claims['uid'])
+        revoked_session = _revoked_sessions.get(claims['sid'])
     
-    cur.execute(
-        "SELECT user_id, expires_at FROM sessions WHERE token = %s",
-        (token,)
-    )
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+    if revoked_user and revoked_user[0] > claims['ver']:
+        return None
+    if revoked_session:
+        return None
     
-    if not row:
+    return claims
+
+def verify_access_token(token: str) -> dict:
+    if not token or not ACCESS_TOKEN_SECRET or token.count('.') != 1:
         return None
     
-    if datetime.now() > row[1]:
+    payload, signature = token.split('.')
+    expected = hmac.new(ACCESS_TOKEN_SECRET.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).digest()
+    try:
+        if not hmac.compare_digest(decode_token_part(signature), expected):
+            return None
+        claims = json.loads(decode_token_part(payload))
+    except ValueError:
         return None
     
-    return row[0]
+    if claims['exp'] < time.time():
+        return None
+    
+    return claims
+
+def decode_token_part(part: str) -> bytes:
+    return base64.urlsafe_b64decode(part + '=' * (-len(part) % 4))
+
+def sync_revocations(conn):
+    """Не чаще раза в REVOCATION_CHECK_INTERVAL секунд дочитывает auth_invalidations в список отзыва.
+    
+    Кроме id после последнего прочитанного перечитываются строки за REVOCATION_LATE_COMMIT_WINDOW секунд:
+    BIGSERIAL выдаёт id до коммита, и бан, закоммиченный позже строки с большим id, иначе был бы пропущен."""
+    now = time.monotonic()
+    with _revocation_lock:
+        if now - _revocation_state['checked_at'] < REVOCATION_CHECK_INTERVAL:
+            return
+        _revocation_state['checked_at'] = now
+        last_id = _revocation_state['invalidation_id']
+    
+    cur = conn.cursor()
+    if last_id is None:
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM auth_invalidations")
+        head = cur.fetchone()[0]
+        cur.execute(
+            """SELECT id, user_id, session_id, token_version FROM auth_invalidations
+            WHERE created_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            ORDER BY id""",
+            (ACCESS_TOKEN_TTL,)
+        )
+    else:
+        head = last_id
+        cur.execute(
+            """SELECT id, user_id, session_id, token_version FROM auth_invalidations
+            WHERE id > %s OR created_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            ORDER BY id""",
+            (last_id, REVOCATION_LATE_COMMIT_WINDOW)
+        )
+    rows = cur.fetchall()
+    cur.close()
+    
+    with _revocation_lock:
+        for invalidation_id, user_id, session_id, token_version in rows:
+            if user_id is not None:
+                _revoked_users[user_id] = (max(token_version or 0, _revoked_users.get(user_id, (0,))[0]), now)
+            if session_id is not None:
+                _revoked_sessions[session_id] = (invalidation_id, now)
+            head = max(head, invalidation_id)
+        _revocation_state['invalidation_id'] = max(head, _revocation_state['invalidation_id'] or 0)
+        
+        for revoked in (_revoked_users, _revoked_sessions):
+            for key in [key for key, entry in revoked.items() if now - entry[1] > ACCESS_TOKEN_TTL]:
+                del revoked[key]
+
+def get_revocation_stats() -> dict:
+    with _revocation_lock:
+        return {'users': len(_revoked_users), 'sessions': len(_revoked_sessions)}
+
+_revocation_lock = threading.Lock()
+_revoked_users = {}
+_revoked_sessions = {}
+_revocation_state = {'invalidation_id': None, 'checked_at': 0.0}
+
+_pool_lock = threading.Condition()
+_pool_idle = []
+_pool_born = {}
+_pool_stats = {'created': 0, 'reused': 0, 'discarded': 0, 'health_check_failures': 0, 'waits': 0}
 
 def get_db_connection():
+    """Выдаёт соединение из пула, живущего между тёплыми вызовами функции"""
+    with _pool_lock:
+        while True:
+            while _pool_idle:
+                conn, last_used = _pool_idle.pop()
+                if is_connection_alive(conn, last_used):
+                    _pool_stats['reused'] += 1
+                    return conn
+                discard_db_connection(conn)
+            
+            if len(_pool_born) < DB_POOL_MAX_SIZE:
+                break
+            
+            _pool_stats['waits'] += 1
+            if not _pool_lock.wait(timeout=DB_POOL_TIMEOUT):
+                raise psycopg2.pool.PoolError('connection pool exhausted')
+        
+        conn = open_db_connection()
+        while len(_pool_born) < DB_POOL_MIN_SIZE:
+            _pool_idle.append((open_db_connection(), time.monotonic()))
+        return conn
+
+def release_db_connection(conn):
+    with _pool_lock:
+        if conn not in _pool_born:
+            return
+        
+        try:
+            if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            pass
+        
+        expired = time.monotonic() - _pool_born[conn] > DB_POOL_MAX_LIFETIME
+        if conn.closed or expired or len(_pool_idle) >= DB_POOL_MAX_SIZE:
+            discard_db_connection(conn)
+        else:
+            _pool_idle.append((conn, time.monotonic()))
+        _pool_lock.notify()
+
+def open_db_connection():
     dsn = os.environ.get('DATABASE_URL')
     schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
     
     conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
-    return conn
\ No newline at end of file
+    _pool_born[conn] = time.monotonic()
+    _pool_stats['created'] += 1
+    return conn
+
+def discard_db_connection(conn):
+    _pool_born.pop(conn, None)
+    _pool_stats['discarded'] += 1
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def is_connection_alive(conn, last_used: float) -> bool:
+    if conn.closed:
+        return False
+    
+    if time.monotonic() - _pool_born[conn] > DB_POOL_MAX_LIFETIME:
+        return False
+    
+    if time.monotonic() - last_used < DB_POOL_CHECK_IDLE:
+        return True
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        _pool_stats['health_check_failures'] += 1
+        return False
+
+def get_pool_stats() -> dict:
+    with _pool_lock:
+        return {
+            'size': len(_pool_born),
+            'idle': len(_pool_idle),
+            'in_use': len(_pool_born) - len(_pool_idle),
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            **_pool_stats
+        }
\ No newline at end of file
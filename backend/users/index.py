@@ -1,7 +1,79 @@
 import json
+import hmac
 import os
+import hashlib
+import gzip
+import base64
+import csv
+import io
+import threading
+import time
+import uuid
+import zlib
+import boto3
 import psycopg2
-from datetime import datetime
+import psycopg2.extensions
+import psycopg2.pool
+from datetime import date, datetime, timedelta
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DB_POOL_MIN_SIZE = int(os.environ.get('DB_POOL_MIN_SIZE', '1'))
+DB_POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+DB_POOL_MAX_LIFETIME = int(os.environ.get('DB_POOL_MAX_LIFETIME', '600'))
+DB_POOL_CHECK_IDLE = int(os.environ.get('DB_POOL_CHECK_IDLE', '30'))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '10'))
+
+ACCESS_TOKEN_SECRET = os.environ.get('ACCESS_TOKEN_SECRET', '')
+ACCESS_TOKEN_TTL = int(os.environ.get('ACCESS_TOKEN_TTL', '900'))
+REVOCATION_CHECK_INTERVAL = float(os.environ.get('REVOCATION_CHECK_INTERVAL', '2'))
+REVOCATION_LATE_COMMIT_WINDOW = 60
+
+USER_SEARCH_PAGE_SIZE = 20
+USER_SEARCH_PAGE_MAX = 50
+USER_SEARCH_TRIGRAM_MIN = 3
+USER_LIST_PAGE_SIZE = 50
+USER_LIST_PAGE_MAX = 200
+USER_ROLES = ('владелец', 'администратор', 'VIP', 'пользователь')
+BULK_MODERATE_CHUNK = 1000
+BULK_MODERATE_MAX = 50000
+BULK_MODERATE_CONFIRM_THRESHOLD = 100
+STATS_SHARDS = 16
+STATS_RANGE_DEFAULT_DAYS = 30
+STATS_RANGE_MAX_DAYS = 366
+EXPORT_FETCH_SIZE = 5000
+EXPORT_PART_SIZE = 8 * 1024 * 1024
+EXPORT_URL_TTL = 3600
+EXPORT_FORMATS = ('ndjson', 'csv')
+EXPORT_QUERIES = {
+    'users': (
+        ('id', 'username', 'email', 'display_name', 'avatar_url', 'role', 'is_banned', 'ban_reason', 'created_at', 'updated_at'),
+        """SELECT id, username, email, display_name, avatar_url, role, is_banned, ban_reason, created_at, updated_at
+        FROM users ORDER BY id"""
+    ),
+    'chats': (
+        ('id', 'created_by', 'direct_key', 'last_message_id', 'last_message_at', 'created_at', 'updated_at'),
+        """SELECT id, created_by, direct_key, last_message_id, last_message_at, created_at, updated_at
+        FROM chats ORDER BY id"""
+    ),
+    'messages': (
+        ('id', 'chat_id', 'sender_id', 'content', 'created_at'),
+        """SELECT id, chat_id, sender_id, content, created_at
+        FROM messages ORDER BY chat_id, created_at, id"""
+    )
+}
+
+S3_ENDPOINT_URL = os.environ.get('S3_ENDPOINT_URL', 'https://bucket.poehali.dev')
+EXPORT_BUCKET = os.environ.get('EXPORT_BUCKET', 'files')
+
+COMPRESS_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+_s3_client = None
 
 def handler(event: dict, context) -> dict:
     """API для управления профилем пользователя и получения данных"""
@@ -13,14 +85,31 @@ def handler(event: dict, context) -> dict:
             'headers': {
                 'Access-Control-Allow-Origin': '*',
                 'Access-Control-Allow-Methods': 'GET, POST, PUT, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization'
+                'Access-Control-Allow-Headers': 'Content-Type, X-Authorization, If-None-Match'
             },
             'body': '',
             'isBase64Encoded': False
         }
     
-    user_id = get_user_from_token(event)
-    if not user_id:
+    action = event.get('queryStringParameters', {}).get('action', '')
+    
+    if method == 'GET' and action == 'health':
+        return {
+            'statusCode': 200,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'status': 'ok', 'pool': get_pool_stats(), 'revocations': get_revocation_stats()}),
+            'isBase64Encoded': False
+        }
+    
+    conn = get_db_connection()
+    try:
+        return compress_response(event, route_request(conn, event, method, action))
+    finally:
+        release_db_connection(conn)
+
+def route_request(conn, event: dict, method: str, action: str) -> dict:
+    principal = get_principal(conn, event)
+    if not principal:
         return {
             'statusCode': 401,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -28,28 +117,34 @@ def handler(event: dict, context) -> dict:
             'isBase64Encoded': False
         }
     
-    action = event.get('queryStringParameters', {}).get('action', '')
+    user_id = principal['uid']
     
     if method == 'GET':
         if action == 'me':
-            return get_current_user(user_id)
+            return get_current_user(conn, event, user_id)
         elif action == 'search':
-            query = event.get('queryStringParameters', {}).get('q', '')
-            return search_users(query, user_id)
+            return search_users(conn, user_id, event.get('queryStringParameters') or {})
         elif action == 'list':
-            return list_all_users(user_id)
+            return list_all_users(conn, principal, event.get('queryStringParameters') or {})
+        elif action == 'stats':
+            return get_stats(conn, principal, event.get('queryStringParameters') or {})
+        elif action == 'export':
+            return export_entity(conn, principal, event.get('queryStringParameters') or {})
     
     if method == 'PUT' and action == 'profile':
-        return update_profile(event, user_id)
+        return update_profile(conn, event, user_id)
     
     if method == 'POST' and action == 'ban':
-        return ban_user(event, user_id)
+        return ban_user(conn, event, principal)
     
     if method == 'POST' and action == 'unban':
-        return unban_user(event, user_id)
+        return unban_user(conn, event, principal)
+    
+    if method == 'POST' and action == 'bulk-moderate':
+        return bulk_moderate(conn, event, principal)
     
     if method == 'POST' and action == 'set-role':
-        return set_user_role(event, user_id)
+        return set_user_role(conn, event, principal)
     
     return {
         'statusCode': 400,
@@ -58,18 +153,17 @@ def handler(event: dict, context) -> dict:
         'isBase64Encoded': False
     }
 
-def get_current_user(user_id: int) -> dict:
-    conn = get_db_connection()
+def get_current_user(conn, event: dict, user_id: int) -> dict:
     cur = conn.cursor()
     
     cur.execute(
-        """SELECT id, username, email, display_name, avatar_url, role, is_banned, ban_reason, created_at
+        """SELECT id, username, email, display_name, avatar_url, role, is_banned, ban_reason, created_at, updated_at,
+        avatars
         FROM users WHERE id = %s""",
         (user_id,)
     )
     row = cur.fetchone()
     cur.close()
-    conn.close()
     
     if not row:
         return {
@@ -79,12 +173,17 @@ def get_current_user(user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
+    etag = make_etag('me', row[0], row[9])
+    if etag_matches(event, etag):
+        return not_modified(etag)
+    
     user = {
         'id': row[0],
         'username': row[1],
         'email': row[2],
         'display_name': row[3],
         'avatar_url': row[4],
+        'avatars': row[10],
         'role': row[5],
         'is_banned': row[6],
         'ban_reason': row[7],
@@ -93,12 +192,18 @@ def get_current_user(user_id: int) -> dict:
     
     return {
         'statusCode': 200,
-        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps(user),
+        'headers': {
+            'Content-Type': 'application/json',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'Cache-Control': 'no-cache',
+            'ETag': etag
+        },
+        'body': dump_json(user),
         'isBase64Encoded': False
     }
 
-def update_profile(event: dict, user_id: int) -> dict:
+def update_profile(conn, event: dict, user_id: int) -> dict:
     body = json.loads(event.get('body', '{}'))
     display_name = body.get('display_name', '').strip()
     avatar_url = body.get('avatar_url', '').strip()
@@ -111,16 +216,22 @@ def update_profile(event: dict, user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
     cur = conn.cursor()
     
     cur.execute(
-        "UPDATE users SET display_name = %s, avatar_url = %s, updated_at = %s WHERE id = %s",
-        (display_name, avatar_url if avatar_url else None, datetime.now(), user_id)
+        """UPDATE users SET display_name = %(display_name)s, avatar_url = %(avatar_url)s,
+        avatars = CASE WHEN avatar_url IS NOT DISTINCT FROM %(avatar_url)s THEN avatars END,
+        updated_at = %(updated_at)s
+        WHERE id = %(user_id)s""",
+        {
+            'display_name': display_name,
+            'avatar_url': avatar_url if avatar_url else None,
+            'updated_at': datetime.now(),
+            'user_id': user_id
+        }
     )
     conn.commit()
     cur.close()
-    conn.close()
     
     return {
         'statusCode': 200,
@@ -129,58 +240,117 @@ def update_profile(event: dict, user_id: int) -> dict:
         'isBase64Encoded': False
     }
 
-def search_users(query: str, current_user_id: int) -> dict:
-    if not query or len(query) < 2:
+def search_users(conn, current_user_id: int, params: dict) -> dict:
+    """Поиск по username и display_name: точное совпадение, затем префикс, затем по похожести; страницы по курсору"""
+    query = (params.get('q') or '').strip()
+    if len(query) < 2:
         return {
             'statusCode': 200,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-            'body': json.dumps({'users': []}),
+            'body': json.dumps({'users': [], 'next_cursor': None}),
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
-    cur = conn.cursor()
+    cursor = None
+    if params.get('cursor'):
+        cursor = decode_user_search_cursor(params['cursor'])
+        if cursor is None:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Некорректный курсор поиска'}),
+                'isBase64Encoded': False
+            }
+    
+    try:
+        limit = max(1, min(int(params.get('limit') or USER_SEARCH_PAGE_SIZE), USER_SEARCH_PAGE_MAX))
+    except ValueError:
+        limit = USER_SEARCH_PAGE_SIZE
     
-    search_pattern = f'%{query}%'
+    escaped = escape_like(query)
+    pattern = f'{escaped}%' if len(query) < USER_SEARCH_TRIGRAM_MIN else f'%{escaped}%'
+    
+    cur = conn.cursor()
     cur.execute(
-        """SELECT id, username, display_name, avatar_url, role, is_banned
-        FROM users 
-        WHERE (username ILIKE %s OR display_name ILIKE %s) AND id != %s
-        LIMIT 20""",
-        (search_pattern, search_pattern, current_user_id)
+        f"""SELECT id, username, display_name, avatar_url, role, is_banned, tier, score, avatars
+        FROM (
+            SELECT u.id, u.username, u.display_name, u.avatar_url, u.role, u.is_banned, u.avatars,
+            CASE
+                WHEN user_search_key(u.username) = user_search_key(%(q)s)
+                OR user_search_key(u.display_name) = user_search_key(%(q)s) THEN 3
+                WHEN user_search_key(u.username) LIKE user_search_key(%(prefix)s)
+                OR user_search_key(u.display_name) LIKE user_search_key(%(prefix)s) THEN 2
+                ELSE 1
+            END AS tier,
+            GREATEST(
+                similarity(user_search_key(u.username), user_search_key(%(q)s)),
+                similarity(user_search_key(u.display_name), user_search_key(%(q)s))
+            )::float8 AS score
+            FROM users u
+            WHERE (user_search_key(u.username) LIKE user_search_key(%(pattern)s)
+            OR user_search_key(u.display_name) LIKE user_search_key(%(pattern)s))
+            AND u.id != %(user_id)s
+        ) ranked
+        {'WHERE (tier, score, id) < (%(tier)s, %(score)s, %(id)s)' if cursor else ''}
+        ORDER BY tier DESC, score DESC, id DESC
+        LIMIT %(limit)s""",
+        {
+            'q': query,
+            'prefix': f'{escaped}%',
+            'pattern': pattern,
+            'user_id': current_user_id,
+            'tier': cursor[0] if cursor else None,
+            'score': cursor[1] if cursor else None,
+            'id': cursor[2] if cursor else None,
+            'limit': limit + 1
+        }
     )
+    rows = cur.fetchall()
+    cur.close()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     
     users = []
-    for row in cur.fetchall():
+    for row in rows:
         users.append({
             'id': row[0],
             'username': row[1],
             'display_name': row[2],
             'avatar_url': row[3],
+            'avatars': row[8],
             'role': row[4],
             'is_banned': row[5]
         })
     
-    cur.close()
-    conn.close()
-    
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'users': users}),
+        'body': dump_json({
+            'users': users,
+            'next_cursor': encode_user_search_cursor(*rows[-1][6:8], rows[-1][0]) if has_more else None
+        }),
         'isBase64Encoded': False
     }
 
-def list_all_users(current_user_id: int) -> dict:
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT role FROM users WHERE id = %s", (current_user_id,))
-    row = cur.fetchone()
-    
-    if not row or row[0] not in ['владелец', 'администратор']:
-        cur.close()
-        conn.close()
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+def encode_user_search_cursor(tier: int, score: float, user_id: int) -> str:
+    raw = f'{tier}:{score!r}:{user_id}'.encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_user_search_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        tier, score, user_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii').split(':')
+        return int(tier), float(score), int(user_id)
+    except (ValueError, UnicodeError):
+        return None
+
+def list_all_users(conn, principal: dict, params: dict) -> dict:
+    """Админский список пользователей: фильтры, страницы по (created_at, id) и оценка total по статистике планировщика"""
+    if principal['role'] not in ['владелец', 'администратор']:
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -188,18 +358,55 @@ def list_all_users(current_user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
+    filters = parse_user_list_filters(params)
+    if filters is None:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Некорректные параметры фильтра'}),
+            'isBase64Encoded': False
+        }
+    conditions, values, cursor, limit = filters
+    
+    cur = conn.cursor()
+    
+    where = ' AND '.join(conditions) or 'TRUE'
+    page_where = where
+    if cursor:
+        page_where += ' AND (created_at, id) < (%(cursor_created_at)s, %(cursor_id)s)'
+        values.update({'cursor_created_at': cursor[0], 'cursor_id': cursor[1]})
+    
     cur.execute(
-        """SELECT id, username, display_name, avatar_url, role, is_banned, ban_reason, email, created_at
-        FROM users ORDER BY created_at DESC"""
+        f"""SELECT id, username, display_name, avatar_url, role, is_banned, ban_reason, email, created_at, avatars
+        FROM users
+        WHERE {page_where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %(limit)s""",
+        {**values, 'limit': limit + 1}
     )
+    rows = cur.fetchall()
+    
+    total_estimate = None
+    if not cursor:
+        cur.execute(f"EXPLAIN (FORMAT JSON) SELECT 1 FROM users WHERE {where}", values)
+        plan = cur.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        total_estimate = plan[0]['Plan']['Plan Rows']
+    
+    cur.close()
+    
+    has_more = len(rows) > limit
+    rows = rows[:limit]
     
     users = []
-    for row in cur.fetchall():
+    for row in rows:
         users.append({
             'id': row[0],
             'username': row[1],
             'display_name': row[2],
             'avatar_url': row[3],
+            'avatars': row[9],
             'role': row[4],
             'is_banned': row[5],
             'ban_reason': row[6],
@@ -207,17 +414,264 @@ def list_all_users(current_user_id: int) -> dict:
             'created_at': row[8].isoformat() if row[8] else None
         })
     
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dump_json({
+            'users': users,
+            'next_cursor': encode_user_list_cursor(rows[-1][8], rows[-1][0]) if has_more else None,
+            'total_estimate': total_estimate
+        }),
+        'isBase64Encoded': False
+    }
+
+def parse_user_list_filters(params: dict) -> tuple:
+    """SQL-условия и параметры фильтров списка; None, если какой-то фильтр не разбирается"""
+    conditions = []
+    values = {}
+    
+    try:
+        limit = max(1, min(int(params.get('limit') or USER_LIST_PAGE_SIZE), USER_LIST_PAGE_MAX))
+        
+        role = params.get('role')
+        if role:
+            if role not in USER_ROLES:
+                return None
+            conditions.append('role = %(role)s')
+            values['role'] = role
+        
+        is_banned = params.get('is_banned')
+        if is_banned:
+            if is_banned not in ('true', 'false'):
+                return None
+            conditions.append('is_banned' if is_banned == 'true' else 'is_banned IS NOT TRUE')
+        
+        if params.get('created_from'):
+            conditions.append('created_at >= %(created_from)s')
+            values['created_from'] = datetime.fromisoformat(params['created_from'])
+        if params.get('created_to'):
+            conditions.append('created_at < %(created_to)s')
+            values['created_to'] = datetime.fromisoformat(params['created_to'])
+        
+        query = (params.get('q') or '').strip()
+        if len(query) >= 2:
+            escaped = escape_like(query)
+            pattern = f'{escaped}%' if len(query) < USER_SEARCH_TRIGRAM_MIN else f'%{escaped}%'
+            conditions.append(
+                '(user_search_key(username) LIKE user_search_key(%(pattern)s) '
+                'OR user_search_key(display_name) LIKE user_search_key(%(pattern)s))'
+            )
+            values['pattern'] = pattern
+        
+        cursor = None
+        if params.get('cursor'):
+            cursor = decode_user_list_cursor(params['cursor'])
+            if cursor is None:
+                return None
+    except (ValueError, TypeError, AttributeError):
+        return None
+    
+    return conditions, values, cursor, limit
+
+def encode_user_list_cursor(created_at: datetime, user_id: int) -> str:
+    raw = f'{created_at.isoformat()}|{user_id}'.encode('ascii')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+def decode_user_list_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, user_id = base64.urlsafe_b64decode(padded.encode('ascii')).decode('ascii').split('|')
+        return datetime.fromisoformat(created_at), int(user_id)
+    except (ValueError, UnicodeError):
+        return None
+
+def get_stats(conn, principal: dict, params: dict) -> dict:
+    """Дашборд по дням из daily_stats: сообщения, активные, регистрации, баны; не больше 16 строк на день"""
+    if principal['role'] not in ['владелец', 'администратор']:
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Доступ запрещён'}),
+            'isBase64Encoded': False
+        }
+    
+    try:
+        date_to = date.fromisoformat(params['to']) if params.get('to') else date.today()
+        date_from = date.fromisoformat(params['from']) if params.get('from') else date_to - timedelta(days=STATS_RANGE_DEFAULT_DAYS - 1)
+    except ValueError:
+        date_from = date_to = None
+    
+    if not date_from or date_from > date_to or (date_to - date_from).days >= STATS_RANGE_MAX_DAYS:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': f'Некорректный период (не больше {STATS_RANGE_MAX_DAYS} дней)'}),
+            'isBase64Encoded': False
+        }
+    
+    cur = conn.cursor()
+    cur.execute(
+        """SELECT d.day::date, COALESCE(SUM(s.messages_sent), 0), COALESCE(SUM(s.active_users), 0),
+        COALESCE(SUM(s.registrations), 0), COALESCE(SUM(s.bans), 0), COALESCE(SUM(s.unbans), 0)
+        FROM generate_series(%s::date, %s::date, INTERVAL '1 day') d(day)
+        LEFT JOIN daily_stats s ON s.day = d.day::date
+        GROUP BY d.day
+        ORDER BY d.day""",
+        (date_from, date_to)
+    )
+    rows = cur.fetchall()
+    
+    cur.execute("SELECT COUNT(*) FROM users WHERE is_banned")
+    banned_now = cur.fetchone()[0]
     cur.close()
-    conn.close()
+    
+    days = []
+    for row in rows:
+        days.append({
+            'day': row[0].isoformat(),
+            'messages_sent': int(row[1]),
+            'active_users': int(row[2]),
+            'registrations': int(row[3]),
+            'bans': int(row[4]),
+            'unbans': int(row[5])
+        })
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': dump_json({
+            'from': date_from.isoformat(),
+            'to': date_to.isoformat(),
+            'days': days,
+            'totals': {
+                'messages_sent': sum(day['messages_sent'] for day in days),
+                'registrations': sum(day['registrations'] for day in days),
+                'bans': sum(day['bans'] for day in days),
+                'unbans': sum(day['unbans'] for day in days)
+            },
+            'banned_now': banned_now
+        }),
+        'isBase64Encoded': False
+    }
+
+def export_entity(conn, principal: dict, params: dict) -> dict:
+    """Выгрузка users/chats/messages в NDJSON или CSV: серверный курсор пачками, gzip частями в хранилище"""
+    if principal['role'] not in ['владелец', 'администратор']:
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Доступ запрещён'}),
+            'isBase64Encoded': False
+        }
+    
+    entity = params.get('entity', '')
+    export_format = params.get('format', 'ndjson')
+    if entity not in EXPORT_QUERIES or export_format not in EXPORT_FORMATS:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'entity: users, chats или messages; format: ndjson или csv'}),
+            'isBase64Encoded': False
+        }
+    
+    columns, query = EXPORT_QUERIES[entity]
+    object_key = f"exports/{entity}/{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex}.{export_format}.gz"
+    s3 = get_s3_client()
+    upload_id = s3.create_multipart_upload(
+        Bucket=EXPORT_BUCKET,
+        Key=object_key,
+        ContentType='application/x-ndjson' if export_format == 'ndjson' else 'text/csv',
+        ContentEncoding='gzip'
+    )['UploadId']
+    
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    pending = bytearray()
+    parts = []
+    row_count = 0
+    
+    export = conn.cursor(name=f'export_{entity}_{uuid.uuid4().hex[:8]}')
+    export.itersize = EXPORT_FETCH_SIZE
+    try:
+        export.execute(query)
+        if export_format == 'csv':
+            pending += compressor.compress(encode_export_rows(export_format, columns, [columns]))
+        
+        while True:
+            rows = export.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            row_count += len(rows)
+            pending += compressor.compress(encode_export_rows(export_format, columns, rows))
+            if len(pending) >= EXPORT_PART_SIZE:
+                parts.append(upload_export_part(s3, object_key, upload_id, len(parts) + 1, bytes(pending)))
+                pending.clear()
+        
+        pending += compressor.flush()
+        parts.append(upload_export_part(s3, object_key, upload_id, len(parts) + 1, bytes(pending)))
+        s3.complete_multipart_upload(
+            Bucket=EXPORT_BUCKET,
+            Key=object_key,
+            UploadId=upload_id,
+            MultipartUpload={'Parts': parts}
+        )
+    except Exception:
+        s3.abort_multipart_upload(Bucket=EXPORT_BUCKET, Key=object_key, UploadId=upload_id)
+        raise
+    finally:
+        export.close()
+        conn.rollback()
     
     return {
         'statusCode': 200,
         'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
-        'body': json.dumps({'users': users}),
+        'body': json.dumps({
+            'entity': entity,
+            'format': export_format,
+            'rows': row_count,
+            'url': s3.generate_presigned_url(
+                'get_object',
+                Params={'Bucket': EXPORT_BUCKET, 'Key': object_key},
+                ExpiresIn=EXPORT_URL_TTL
+            ),
+            'expires_in': EXPORT_URL_TTL
+        }),
         'isBase64Encoded': False
     }
 
-def ban_user(event: dict, current_user_id: int) -> dict:
+def encode_export_rows(export_format: str, columns: tuple, rows: list) -> bytes:
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(value.isoformat() if isinstance(value, datetime) else value for value in row)
+        return buffer.getvalue().encode('utf-8')
+    
+    return ''.join(
+        dump_json({column: value.isoformat() if isinstance(value, datetime) else value for column, value in zip(columns, row)}) + '\n'
+        for row in rows
+    ).encode('utf-8')
+
+def upload_export_part(s3, object_key: str, upload_id: str, part_number: int, data: bytes) -> dict:
+    response = s3.upload_part(
+        Bucket=EXPORT_BUCKET,
+        Key=object_key,
+        UploadId=upload_id,
+        PartNumber=part_number,
+        Body=data
+    )
+    return {'PartNumber': part_number, 'ETag': response['ETag']}
+
+def get_s3_client():
+    global _s3_client
+    if _s3_client is None:
+        _s3_client = boto3.client('s3',
+            endpoint_url=S3_ENDPOINT_URL,
+            aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+            aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY']
+        )
+    return _s3_client
+
+def ban_user(conn, event: dict, principal: dict) -> dict:
     body = json.loads(event.get('body', '{}'))
     target_user_id = body.get('user_id')
     reason = body.get('reason', 'Нарушение правил').strip()
@@ -230,15 +684,7 @@ def ban_user(event: dict, current_user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT role FROM users WHERE id = %s", (current_user_id,))
-    row = cur.fetchone()
-    
-    if not row or row[0] not in ['владелец', 'администратор']:
-        cur.close()
-        conn.close()
+    if principal['role'] not in ['владелец', 'администратор']:
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -246,13 +692,36 @@ def ban_user(event: dict, current_user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
+    cur = conn.cursor()
+    
     cur.execute(
-        "UPDATE users SET is_banned = TRUE, ban_reason = %s, updated_at = %s WHERE id = %s",
+        """WITH changed AS (
+            UPDATE users u SET is_banned = TRUE, ban_reason = %s, token_version = u.token_version + 1, updated_at = %s
+            FROM (SELECT id, is_banned FROM users WHERE id = %s FOR UPDATE) previous
+            WHERE u.id = previous.id
+            RETURNING u.id, u.token_version, previous.is_banned
+        ),
+        revoked AS (
+            INSERT INTO auth_invalidations (user_id, token_version) SELECT id, token_version FROM changed RETURNING id
+        )
+        SELECT changed.is_banned, (SELECT COUNT(*) FROM revoked) FROM changed""",
         (reason, datetime.now(), target_user_id)
     )
+    row = cur.fetchone()
+    if not row:
+        conn.rollback()
+        cur.close()
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Пользователь не найден'}),
+            'isBase64Encoded': False
+        }
+    
+    if not row[0]:
+        bump_daily_stats(cur, target_user_id, 'bans')
     conn.commit()
     cur.close()
-    conn.close()
     
     return {
         'statusCode': 200,
@@ -261,7 +730,7 @@ def ban_user(event: dict, current_user_id: int) -> dict:
         'isBase64Encoded': False
     }
 
-def unban_user(event: dict, current_user_id: int) -> dict:
+def unban_user(conn, event: dict, principal: dict) -> dict:
     body = json.loads(event.get('body', '{}'))
     target_user_id = body.get('user_id')
     
@@ -273,15 +742,7 @@ def unban_user(event: dict, current_user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT role FROM users WHERE id = %s", (current_user_id,))
-    row = cur.fetchone()
-    
-    if not row or row[0] not in ['владелец', 'администратор']:
-        cur.close()
-        conn.close()
+    if principal['role'] not in ['владелец', 'администратор']:
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -289,13 +750,36 @@ def unban_user(event: dict, current_user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
+    cur = conn.cursor()
+    
     cur.execute(
-        "UPDATE users SET is_banned = FALSE, ban_reason = NULL, updated_at = %s WHERE id = %s",
+        """WITH changed AS (
+            UPDATE users u SET is_banned = FALSE, ban_reason = NULL, token_version = u.token_version + 1, updated_at = %s
+            FROM (SELECT id, is_banned FROM users WHERE id = %s FOR UPDATE) previous
+            WHERE u.id = previous.id
+            RETURNING u.id, u.token_version, previous.is_banned
+        ),
+        revoked AS (
+            INSERT INTO auth_invalidations (user_id, token_version) SELECT id, token_version FROM changed RETURNING id
+        )
+        SELECT changed.is_banned, (SELECT COUNT(*) FROM revoked) FROM changed""",
         (datetime.now(), target_user_id)
     )
+    row = cur.fetchone()
+    if not row:
+        conn.rollback()
+        cur.close()
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Пользователь не найден'}),
+            'isBase64Encoded': False
+        }
+    
+    if row[0]:
+        bump_daily_stats(cur, target_user_id, 'unbans')
     conn.commit()
     cur.close()
-    conn.close()
     
     return {
         'statusCode': 200,
@@ -304,7 +788,7 @@ def unban_user(event: dict, current_user_id: int) -> dict:
         'isBase64Encoded': False
     }
 
-def set_user_role(event: dict, current_user_id: int) -> dict:
+def set_user_role(conn, event: dict, principal: dict) -> dict:
     body = json.loads(event.get('body', '{}'))
     target_user_id = body.get('user_id')
     role = body.get('role', '').strip()
@@ -325,15 +809,7 @@ def set_user_role(event: dict, current_user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
-    conn = get_db_connection()
-    cur = conn.cursor()
-    
-    cur.execute("SELECT role FROM users WHERE id = %s", (current_user_id,))
-    row = cur.fetchone()
-    
-    if not row or row[0] != 'владелец':
-        cur.close()
-        conn.close()
+    if principal['role'] != 'владелец':
         return {
             'statusCode': 403,
             'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
@@ -341,13 +817,28 @@ def set_user_role(event: dict, current_user_id: int) -> dict:
             'isBase64Encoded': False
         }
     
+    cur = conn.cursor()
+    
     cur.execute(
-        "UPDATE users SET role = %s, updated_at = %s WHERE id = %s",
+        """WITH changed AS (
+            UPDATE users SET role = %s, token_version = token_version + 1, updated_at = %s WHERE id = %s
+            RETURNING id, token_version
+        )
+        INSERT INTO auth_invalidations (user_id, token_version) SELECT id, token_version FROM changed RETURNING id""",
         (role, datetime.now(), target_user_id)
     )
+    row = cur.fetchone()
+    if not row:
+        conn.rollback()
+        cur.close()
+        return {
+            'statusCode': 404,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Пользователь не найден'}),
+            'isBase64Encoded': False
+        }
     conn.commit()
     cur.close()
-    conn.close()
     
     return {
         'statusCode': 200,
@@ -356,36 +847,482 @@ def set_user_role(event: dict, current_user_id: int) -> dict:
         'isBase64Encoded': False
     }
 
-def get_user_from_token(event: dict) -> int:
-    auth_header = event.get('headers', {}).get('X-Authorization', '')
+def bulk_moderate(conn, event: dict, principal: dict) -> dict:
+    """Бан, разбан или смена роли для списка id либо фильтра списка пользователей.
     
-    if not auth_header:
-        return None
+    Пачки по BULK_MODERATE_CHUNK: одна транзакция на пачку меняет пользователей, пишет отзыв токенов
+    в auth_invalidations и при бане удаляет refresh-сессии. Пользователи, которых операция не меняет,
+    владельцы (для бана) и сам модератор пропускаются. Фильтр без условий не принимается; если под
+    операцию попадает больше BULK_MODERATE_CONFIRM_THRESHOLD пользователей, нужен confirm, равный
+    их числу из ответа 409."""
+    body = json.loads(event.get('body', '{}'))
+    operation = body.get('operation')
+    user_ids = body.get('user_ids')
+    user_filter = body.get('filter')
+    role = (body.get('role') or '').strip()
+    reason = (body.get('reason') or 'Нарушение правил').strip()
     
-    token = auth_header.replace('Bearer ', '')
+    if operation not in ('ban', 'unban', 'set-role') or (user_ids is None) == (user_filter is None):
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Нужны operation и либо user_ids, либо filter'}),
+            'isBase64Encoded': False
+        }
+    
+    if operation == 'set-role' and role not in USER_ROLES:
+        return {
+            'statusCode': 400,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Недопустимая роль'}),
+            'isBase64Encoded': False
+        }
+    
+    if user_ids is not None:
+        try:
+            user_ids = sorted({int(target_id) for target_id in user_ids})
+        except (TypeError, ValueError):
+            user_ids = None
+        if user_ids is None or len(user_ids) > BULK_MODERATE_MAX:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': f'user_ids: список до {BULK_MODERATE_MAX} id'}),
+                'isBase64Encoded': False
+            }
+        conditions, values = [], {}
+    else:
+        if isinstance(user_filter, dict):
+            user_filter = {key: str(value).lower() if isinstance(value, bool) else value for key, value in user_filter.items()}
+        filters = parse_user_list_filters(user_filter) if isinstance(user_filter, dict) else None
+        if filters is None:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Некорректные параметры фильтра'}),
+                'isBase64Encoded': False
+            }
+        conditions, values = filters[0], filters[1]
+        if not conditions:
+            return {
+                'statusCode': 400,
+                'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+                'body': json.dumps({'error': 'Фильтр без условий затронул бы всех пользователей'}),
+                'isBase64Encoded': False
+            }
+    
+    allowed = ['владелец'] if operation == 'set-role' else ['владелец', 'администратор']
+    
+    if principal['role'] not in allowed:
+        return {
+            'statusCode': 403,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({'error': 'Только владелец может менять роли' if operation == 'set-role' else 'Доступ запрещён'}),
+            'isBase64Encoded': False
+        }
     
-    conn = get_db_connection()
     cur = conn.cursor()
     
+    if user_ids is not None:
+        matched = len(user_ids)
+    else:
+        cur.execute(
+            f"""SELECT COUNT(*) FROM (
+                SELECT 1 FROM users WHERE {' AND '.join(conditions)} LIMIT %(cap)s
+            ) matched""",
+            {**values, 'cap': BULK_MODERATE_MAX}
+        )
+        matched = cur.fetchone()[0]
+    
+    if matched > BULK_MODERATE_CONFIRM_THRESHOLD and body.get('confirm') != matched:
+        cur.close()
+        conn.rollback()
+        return {
+            'statusCode': 409,
+            'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+            'body': json.dumps({
+                'error': f'Операция затронет {matched} пользователей: повторите запрос с confirm: {matched}',
+                'matched': matched,
+                'confirm_required': True
+            }),
+            'isBase64Encoded': False
+        }
+    
+    stats_column = None
+    if operation == 'ban':
+        change = "is_banned = TRUE, ban_reason = %(reason)s"
+        guard = "is_banned IS NOT TRUE AND role <> 'владелец'"
+        stats_column = 'bans'
+    elif operation == 'unban':
+        change = "is_banned = FALSE, ban_reason = NULL"
+        guard = "is_banned"
+        stats_column = 'unbans'
+    else:
+        change = "role = %(role)s"
+        guard = "role <> %(role)s"
+    
+    counted = ''
+    if stats_column:
+        counted = f""",
+            counted AS (
+                INSERT INTO daily_stats (day, shard, {stats_column})
+                SELECT CURRENT_DATE, MOD(id, %(stats_shards)s), COUNT(*) FROM changed GROUP BY 2
+                ON CONFLICT (day, shard) DO UPDATE SET {stats_column} = daily_stats.{stats_column} + EXCLUDED.{stats_column}
+                RETURNING day
+            )"""
+    
+    if user_ids is not None:
+        batch = "SELECT id FROM users WHERE id = ANY(%(ids)s::int[]) AND id > %(after_id)s ORDER BY id LIMIT %(chunk)s"
+    else:
+        batch = f"""SELECT id FROM users
+            WHERE {' AND '.join(conditions + ['id > %(after_id)s'])}
+            ORDER BY id LIMIT %(chunk)s"""
+    
+    updated = 0
+    sessions_revoked = 0
+    scanned = 0
+    after_id = 0
+    has_more = True
+    
+    while has_more and scanned < BULK_MODERATE_MAX:
+        cur.execute(
+            f"""WITH batch AS ({batch}),
+            changed AS (
+                UPDATE users SET {change}, token_version = token_version + 1, updated_at = %(now)s
+                WHERE id IN (SELECT id FROM batch) AND id <> %(moderator_id)s AND {guard}
+                RETURNING id, token_version
+            ),
+            revoked AS (
+                INSERT INTO auth_invalidations (user_id, token_version)
+                SELECT id, token_version FROM changed
+                RETURNING id
+            ),
+            dropped AS (
+                DELETE FROM sessions
+                WHERE %(drop_sessions)s AND user_id IN (SELECT id FROM changed)
+                RETURNING id
+            ){counted}
+            SELECT (SELECT COUNT(*) FROM batch), (SELECT MAX(id) FROM batch),
+            (SELECT COUNT(*) FROM changed), (SELECT COUNT(*) FROM revoked), (SELECT COUNT(*) FROM dropped)""",
+            {
+                **values,
+                'ids': user_ids,
+                'after_id': after_id,
+                'chunk': BULK_MODERATE_CHUNK,
+                'now': datetime.now(),
+                'moderator_id': principal['uid'],
+                'reason': reason,
+                'role': role,
+                'drop_sessions': operation == 'ban',
+                'stats_shards': STATS_SHARDS
+            }
+        )
+        batch_size, last_id, changed, _, dropped = cur.fetchone()
+        conn.commit()
+        
+        scanned += batch_size
+        updated += changed
+        sessions_revoked += dropped
+        has_more = batch_size == BULK_MODERATE_CHUNK
+        after_id = last_id or after_id
+    
+    cur.close()
+    
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'Access-Control-Allow-Origin': '*'},
+        'body': json.dumps({
+            'operation': operation,
+            'matched': scanned,
+            'updated': updated,
+            'sessions_revoked': sessions_revoked,
+            'has_more': has_more
+        }),
+        'isBase64Encoded': False
+    }
+
+def bump_daily_stats(cur, user_id: int, column: str, amount: int = 1):
+    """Прибавляет к сегодняшнему счётчику daily_stats в шарде пользователя"""
     cur.execute(
-        "SELECT user_id, expires_at FROM sessions WHERE token = %s",
-        (token,)
+        f"""INSERT INTO daily_stats (day, shard, {column}) VALUES (CURRENT_DATE, MOD(%s, %s), %s)
+        ON CONFLICT (day, shard) DO UPDATE SET {column} = daily_stats.{column} + EXCLUDED.{column}""",
+        (user_id, STATS_SHARDS, amount)
     )
-    row = cur.fetchone()
-    cur.close()
-    conn.close()
+
+def dump_json(data) -> str:
+    """То же, что dump_json в chats: json.dumps без проверки циклов."""
+    return json.dumps(data, check_circular=False)
+
+def compress_response(event: dict, response: dict) -> dict:
+    """gzip/brotli для крупных JSON-ответов по Accept-Encoding клиента"""
+    body = response.get('body')
+    if response.get('isBase64Encoded') or not body or len(body) < COMPRESS_MIN_BYTES:
+        return response
     
-    if not row:
+    encoding = negotiate_encoding(get_header(event, 'Accept-Encoding'))
+    if not encoding:
+        return response
+    
+    raw = body.encode('utf-8')
+    if encoding == 'br':
+        compressed = brotli.compress(raw, quality=BROTLI_QUALITY)
+    else:
+        compressed = gzip.compress(raw, compresslevel=GZIP_LEVEL)
+    
+    headers = dict(response.get('headers', {}))
+    headers['Content-Encoding'] = encoding
+    headers['Vary'] = 'Accept-Encoding'
+    if 'ETag' in headers:
+        headers['ETag'] = headers['ETag'][:-1] + f'-{encoding}"'
+    
+    return {
+        **response,
+        'headers': headers,
+        'body': base64.b64encode(compressed).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+def negotiate_encoding(accept_encoding: str) -> str:
+    accepted = {}
+    for item in accept_encoding.split(','):
+        name, _, params = item.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    
+    if brotli and accepted.get('br', 0) > 0:
+        return 'br'
+    if accepted.get('gzip', 0) > 0:
+        return 'gzip'
+    return None
+
+def make_etag(*version) -> str:
+    digest = hashlib.sha256(':'.join(str(part) for part in version).encode('utf-8')).hexdigest()
+    return f'"{digest[:32]}"'
+
+def etag_matches(event: dict, etag: str) -> bool:
+    header = get_header(event, 'If-None-Match')
+    if not header:
+        return False
+    tags = [tag.strip().replace('-gzip"', '"').replace('-br"', '"') for tag in header.split(',')]
+    return header.strip() == '*' or etag in tags
+
+def not_modified(etag: str) -> dict:
+    return {
+        'statusCode': 304,
+        'headers': {
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'Cache-Control': 'no-cache',
+            'ETag': etag
+        },
+        'body': '',
+        'isBase64Encoded': False
+    }
+
+def get_header(event: dict, name: str) -> str:
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return ''
+
+def get_auth_token(event: dict) -> str:
+    auth_header = event.get('headers', {}).get('X-Authorization', '')
+    return auth_header.replace('Bearer ', '')
+
+def get_principal(conn, event: dict) -> dict:
+    """Кто делает запрос: claims подписанного access-токена (uid, role, sid, ver, exp).
+    
+    Загружается один раз в начале запроса, все проверки прав берут роль отсюда; ни sessions,
+    ни users на этом пути не читаются."""
+    claims = verify_access_token(get_auth_token(event))
+    
+    if not claims or 'ver' not in claims:
         return None
     
-    if datetime.now() > row[1]:
+    sync_revocations(conn)
+    
+    with _revocation_lock:
+        revoked_user = _revoked_users.get(claims['uid'])
+        revoked_session = _revoked_sessions.get(claims['sid'])
+    
+    if revoked_user and revoked_user[0] > claims['ver']:
+        return None
+    if revoked_session:
+        return None
+    
+    return claims
+
+def verify_access_token(token: str) -> dict:
+    if not token or not ACCESS_TOKEN_SECRET or token.count('.') != 1:
         return None
     
-    return row[0]
+    payload, signature = token.split('.')
+    expected = hmac.new(ACCESS_TOKEN_SECRET.encode('utf-8'), payload.encode('utf-8'), hashlib.sha256).digest()
+    try:
+        if not hmac.compare_digest(decode_token_part(signature), expected):
+            return None
+        claims = json.loads(decode_token_part(payload))
+    except ValueError:
+        return None
+    
+    if claims['exp'] < time.time():
+        return None
+    
+    return claims
+
+def decode_token_part(part: str) -> bytes:
+    return base64.urlsafe_b64decode(part + '=' * (-len(part) % 4))
+
+def sync_revocations(conn):
+    """Не чаще раза в REVOCATION_CHECK_INTERVAL секунд дочитывает auth_invalidations в список отзыва.
+    
+    Кроме id после последнего прочитанного перечитываются строки за REVOCATION_LATE_COMMIT_WINDOW секунд:
+    BIGSERIAL выдаёт id до коммита, и бан, закоммиченный позже строки с большим id, иначе был бы пропущен."""
+    now = time.monotonic()
+    with _revocation_lock:
+        if now - _revocation_state['checked_at'] < REVOCATION_CHECK_INTERVAL:
+            return
+        _revocation_state['checked_at'] = now
+        last_id = _revocation_state['invalidation_id']
+    
+    cur = conn.cursor()
+    if last_id is None:
+        cur.execute("SELECT COALESCE(MAX(id), 0) FROM auth_invalidations")
+        head = cur.fetchone()[0]
+        cur.execute(
+            """SELECT id, user_id, session_id, token_version FROM auth_invalidations
+            WHERE created_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            ORDER BY id""",
+            (ACCESS_TOKEN_TTL,)
+        )
+    else:
+        head = last_id
+        cur.execute(
+            """SELECT id, user_id, session_id, token_version FROM auth_invalidations
+            WHERE id > %s OR created_at > CURRENT_TIMESTAMP - %s * INTERVAL '1 second'
+            ORDER BY id""",
+            (last_id, REVOCATION_LATE_COMMIT_WINDOW)
+        )
+    rows = cur.fetchall()
+    cur.close()
+    
+    with _revocation_lock:
+        for invalidation_id, user_id, session_id, token_version in rows:
+            if user_id is not None:
+                _revoked_users[user_id] = (max(token_version or 0, _revoked_users.get(user_id, (0,))[0]), now)
+            if session_id is not None:
+                _revoked_sessions[session_id] = (invalidation_id, now)
+            head = max(head, invalidation_id)
+        _revocation_state['invalidation_id'] = max(head, _revocation_state['invalidation_id'] or 0)
+        
+        for revoked in (_revoked_users, _revoked_sessions):
+            for key in [key for key, entry in revoked.items() if now - entry[1] > ACCESS_TOKEN_TTL]:
+                del revoked[key]
+
+def get_revocation_stats() -> dict:
+    with _revocation_lock:
+        return {'users': len(_revoked_users), 'sessions': len(_revoked_sessions)}
+
+_revocation_lock = threading.Lock()
+_revoked_users = {}
+_revoked_sessions = {}
+_revocation_state = {'invalidation_id': None, 'checked_at': 0.0}
+
+_pool_lock = threading.Condition()
+_pool_idle = []
+_pool_born = {}
+_pool_stats = {'created': 0, 'reused': 0, 'discarded': 0, 'health_check_failures': 0, 'waits': 0}
 
 def get_db_connection():
+    """Выдаёт соединение из пула, живущего между тёплыми вызовами функции"""
+    with _pool_lock:
+        while True:
+            while _pool_idle:
+                conn, last_used = _pool_idle.pop()
+                if is_connection_alive(conn, last_used):
+                    _pool_stats['reused'] += 1
+                    return conn
+                discard_db_connection(conn)
+            
+            if len(_pool_born) < DB_POOL_MAX_SIZE:
+                break
+            
+            _pool_stats['waits'] += 1
+            if not _pool_lock.wait(timeout=DB_POOL_TIMEOUT):
+                raise psycopg2.pool.PoolError('connection pool exhausted')
+        
+        conn = open_db_connection()
+        while len(_pool_born) < DB_POOL_MIN_SIZE:
+            _pool_idle.append((open_db_connection(), time.monotonic()))
+        return conn
+
+def release_db_connection(conn):
+    with _pool_lock:
+        if conn not in _pool_born:
+            return
+        
+        try:
+            if not conn.closed and conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        except psycopg2.Error:
+            pass
+        
+        expired = time.monotonic() - _pool_born[conn] > DB_POOL_MAX_LIFETIME
+        if conn.closed or expired or len(_pool_idle) >= DB_POOL_MAX_SIZE:
+            discard_db_connection(conn)
+        else:
+            _pool_idle.append((conn, time.monotonic()))
+        _pool_lock.notify()
+
+def open_db_connection():
     dsn = os.environ.get('DATABASE_URL')
     schema = os.environ.get('MAIN_DB_SCHEMA', 'public')
     
     conn = psycopg2.connect(dsn, options=f'-c search_path={schema}')
-    return conn
\ No newline at end of file
+    _pool_born[conn] = time.monotonic()
+    _pool_stats['created'] += 1
+    return conn
+
+def discard_db_connection(conn):
+    _pool_born.pop(conn, None)
+    _pool_stats['discarded'] += 1
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+def is_connection_alive(conn, last_used: float) -> bool:
+    if conn.closed:
+        return False
+    
+    if time.monotonic() - _pool_born[conn] > DB_POOL_MAX_LIFETIME:
+        return False
+    
+    if time.monotonic() - last_used < DB_POOL_CHECK_IDLE:
+        return True
+    
+    try:
+        cur = conn.cursor()
+        cur.execute("SELECT 1")
+        cur.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        _pool_stats['health_check_failures'] += 1
+        return False
+
+def get_pool_stats() -> dict:
+    with _pool_lock:
+        return {
+            'size': len(_pool_born),
+            'idle': len(_pool_idle),
+            'in_use': len(_pool_born) - len(_pool_idle),
+            'min_size': DB_POOL_MIN_SIZE,
+            'max_size': DB_POOL_MAX_SIZE,
+            **_pool_stats
+        }
\ No newline at end of file
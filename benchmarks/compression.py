@@ -0,0 +1,83 @@
+"""CPU cost vs bytes saved for compressed handler responses.
+
+Runs the real compress_response() from backend/chats against synthetic
+get_messages bodies of growing size:
+
+    pip install -r backend/chats/requirements.txt
+    python benchmarks/compression.py
+"""
+import importlib.util
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = ['привет', 'как', 'дела', 'завтра', 'встреча', 'в', 'офисе', 'ok', 'отправил', 'файл',
+         'созвон', 'через', 'минут', 'спасибо', 'договорились', 'проект', 'отчёт', 'готов']
+GZIP_LEVELS = [1, 6, 9]
+BROTLI_QUALITIES = [1, 5, 11]
+TARGET_SIZES = [512, 1024, 2 * 1024, 16 * 1024, 128 * 1024, 1024 * 1024, 4 * 1024 * 1024]
+
+def load_handler(name: str):
+    spec = importlib.util.spec_from_file_location(name, os.path.join(ROOT, 'backend', name, 'index.py'))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def make_messages_body(target_size: int) -> str:
+    started = datetime(2024, 1, 1, 12, 0, 0)
+    messages = []
+    size = 0
+    i = 0
+    while size < target_size:
+        message = {
+            'id': 1000 + i * 7,
+            'content': f'Сообщение {i}: ' + ' '.join(WORDS[(i * 5 + k) % len(WORDS)] for k in range(3 + i % 12)),
+            'sender_id': 1 + i % 2,
+            'created_at': (started + timedelta(seconds=i * 37 + i % 13)).isoformat(),
+            'sender': {
+                'username': f'user_{1 + i % 2}',
+                'display_name': f'Пользователь {1 + i % 2}',
+                'avatar_url': f'https://cdn.poehali.dev/avatars/{1 + i % 2}.png'
+            }
+        }
+        messages.append(message)
+        size += len(json.dumps(message)) + 2
+        i += 1
+    return json.dumps({'messages': messages, 'next_cursor': None, 'has_more': False})
+
+def measure(chats, body: str, encoding: str, repeat: int) -> tuple:
+    event = {'headers': {'Accept-Encoding': encoding}}
+    response = {'statusCode': 200, 'headers': {}, 'body': body, 'isBase64Encoded': False}
+    
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = chats.compress_response(event, response)
+    elapsed = (time.perf_counter() - started) / repeat
+    
+    if not result['isBase64Encoded']:
+        return len(body.encode('utf-8')), elapsed
+    return len(result['body']) * 3 // 4, elapsed
+
+def main():
+    chats = load_handler('chats')
+    settings = [('gzip', level) for level in GZIP_LEVELS]
+    if chats.brotli:
+        settings += [('br', quality) for quality in BROTLI_QUALITIES]
+    
+    print(f"{'size':>10} {'encoding':>8} {'level':>5} {'bytes':>10} {'saved':>7} {'cpu ms':>8} {'MB/s':>8}")
+    for target_size in TARGET_SIZES:
+        body = make_messages_body(target_size)
+        raw_size = len(body.encode('utf-8'))
+        repeat = max(3, min(200, 2_000_000 // raw_size))
+        
+        for encoding, level in settings:
+            chats.GZIP_LEVEL = chats.BROTLI_QUALITY = level
+            size, elapsed = measure(chats, body, encoding, repeat)
+            saved = 1 - size / raw_size
+            throughput = raw_size / elapsed / 1024 / 1024 if elapsed else 0
+            print(f"{raw_size:>10} {encoding:>8} {level:>5} {size:>10} {saved:>6.0%} {elapsed * 1000:>8.2f} {throughput:>8.1f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,21 @@
+-- Inbox projection: last message state kept on the chat row by send_message
+ALTER TABLE chats ADD COLUMN last_message_id INTEGER;
+ALTER TABLE chats ADD COLUMN last_message_preview TEXT;
+ALTER TABLE chats ADD COLUMN last_message_at TIMESTAMP;
+ALTER TABLE chats ADD COLUMN last_message_sender_id INTEGER REFERENCES users(id);
+
+-- Backfill from existing messages
+UPDATE chats c SET
+    last_message_id = m.id,
+    last_message_preview = LEFT(m.content, 200),
+    last_message_at = m.created_at,
+    last_message_sender_id = m.sender_id
+FROM (
+    SELECT DISTINCT ON (chat_id) id, chat_id, sender_id, content, created_at
+    FROM messages
+    ORDER BY chat_id, created_at DESC, id DESC
+) m
+WHERE m.chat_id = c.id;
+
+-- Inbox listing walks the caller's participations, then the other participant
+CREATE INDEX idx_chat_participants_user_chat ON chat_participants(user_id, chat_id);
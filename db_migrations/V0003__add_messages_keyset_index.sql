@@ -0,0 +1,5 @@
+-- Keyset pagination of chat history: each page is a bounded scan of this index
+CREATE INDEX idx_messages_chat_created_id ON messages(chat_id, created_at, id);
+
+-- Superseded by the composite index above
+DROP INDEX idx_messages_chat_id;
@@ -0,0 +1,10 @@
+-- Monotonic change sequence for chats?action=sync
+CREATE SEQUENCE change_seq;
+
+ALTER TABLE chats ADD COLUMN change_seq BIGINT NOT NULL DEFAULT nextval('change_seq');
+ALTER TABLE messages ADD COLUMN change_seq BIGINT NOT NULL DEFAULT nextval('change_seq');
+ALTER TABLE contacts ADD COLUMN change_seq BIGINT NOT NULL DEFAULT nextval('change_seq');
+
+CREATE INDEX idx_chats_change_seq ON chats(change_seq);
+CREATE INDEX idx_messages_chat_change_seq ON messages(chat_id, change_seq);
+CREATE INDEX idx_contacts_user_change_seq ON contacts(user_id, change_seq);
@@ -0,0 +1,9 @@
+-- Per-participant read cursor and incrementally maintained unread counter
+ALTER TABLE chat_participants ADD COLUMN last_read_message_id INTEGER;
+ALTER TABLE chat_participants ADD COLUMN unread_count INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE chat_participants ADD COLUMN change_seq BIGINT NOT NULL DEFAULT nextval('change_seq');
+
+-- Existing history is treated as read
+UPDATE chat_participants cp SET last_read_message_id = c.last_message_id
+FROM chats c
+WHERE c.id = cp.chat_id;
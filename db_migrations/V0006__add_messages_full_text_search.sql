@@ -0,0 +1,5 @@
+-- Full-text search over message content (russian stemming + simple for names, codes, other languages)
+ALTER TABLE messages ADD COLUMN content_tsv tsvector
+    GENERATED ALWAYS AS (to_tsvector('russian', content) || to_tsvector('simple', content)) STORED;
+
+CREATE INDEX idx_messages_content_tsv ON messages USING GIN (content_tsv);
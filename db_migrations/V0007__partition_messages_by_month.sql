@@ -0,0 +1,83 @@
+-- Monthly range partitions for messages, with an archive catalogue for detached months
+
+CREATE OR REPLACE FUNCTION ensure_messages_partitions(range_start TIMESTAMP, range_end TIMESTAMP)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', range_start)::date;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= range_end LOOP
+        partition_name := 'messages_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, (month_start + INTERVAL '1 month')::date
+            );
+            created := created + 1;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+ALTER SEQUENCE messages_id_seq OWNED BY NONE;
+ALTER TABLE messages RENAME TO messages_unpartitioned;
+ALTER TABLE messages_unpartitioned RENAME CONSTRAINT messages_pkey TO messages_unpartitioned_pkey;
+DROP INDEX idx_messages_chat_created_id;
+DROP INDEX idx_messages_chat_change_seq;
+DROP INDEX idx_messages_content_tsv;
+
+CREATE TABLE messages (
+    id INTEGER NOT NULL DEFAULT nextval('messages_id_seq'),
+    chat_id INTEGER REFERENCES chats(id),
+    sender_id INTEGER REFERENCES users(id),
+    content TEXT NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    change_seq BIGINT NOT NULL DEFAULT nextval('change_seq'),
+    content_tsv tsvector
+        GENERATED ALWAYS AS (to_tsvector('russian', content) || to_tsvector('simple', content)) STORED,
+    PRIMARY KEY (id, created_at)
+) PARTITION BY RANGE (created_at);
+
+SELECT ensure_messages_partitions(
+    COALESCE(MIN(created_at), CURRENT_TIMESTAMP),
+    CURRENT_TIMESTAMP + INTERVAL '3 months'
+) FROM messages_unpartitioned;
+
+INSERT INTO messages (id, chat_id, sender_id, content, created_at, change_seq)
+SELECT id, chat_id, sender_id, content, COALESCE(created_at, CURRENT_TIMESTAMP), change_seq
+FROM messages_unpartitioned;
+
+DROP TABLE messages_unpartitioned;
+ALTER SEQUENCE messages_id_seq OWNED BY messages.id;
+
+CREATE INDEX idx_messages_chat_created_id ON messages(chat_id, created_at, id);
+CREATE INDEX idx_messages_chat_change_seq ON messages(chat_id, change_seq);
+CREATE INDEX idx_messages_content_tsv ON messages USING GIN (content_tsv);
+
+-- Months exported to the object store and detached from messages
+CREATE TABLE message_archives (
+    id SERIAL PRIMARY KEY,
+    partition_name VARCHAR(64) UNIQUE NOT NULL,
+    range_start TIMESTAMP NOT NULL,
+    range_end TIMESTAMP NOT NULL,
+    message_count INTEGER NOT NULL,
+    archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+-- One gzip NDJSON object per chat per archived month
+CREATE TABLE message_archive_chunks (
+    id SERIAL PRIMARY KEY,
+    archive_id INTEGER REFERENCES message_archives(id),
+    chat_id INTEGER NOT NULL,
+    object_key TEXT NOT NULL,
+    message_count INTEGER NOT NULL,
+    min_message_id INTEGER NOT NULL,
+    max_message_id INTEGER NOT NULL,
+    first_created_at TIMESTAMP NOT NULL,
+    last_created_at TIMESTAMP NOT NULL
+);
+
+CREATE INDEX idx_message_archive_chunks_chat ON message_archive_chunks(chat_id, first_created_at);
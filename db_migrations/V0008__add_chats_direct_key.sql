@@ -0,0 +1,18 @@
+-- Canonical "min_user_id:max_user_id" key for 1:1 chats: O(1) lookup and no duplicate chats under races
+ALTER TABLE chats ADD COLUMN direct_key VARCHAR(32);
+
+-- Backfill: the oldest chat of each pair keeps the key, earlier race duplicates stay unkeyed
+UPDATE chats c SET direct_key = pair.direct_key
+FROM (
+    SELECT DISTINCT ON (direct_key) chat_id, direct_key
+    FROM (
+        SELECT chat_id, MIN(user_id) || ':' || MAX(user_id) AS direct_key
+        FROM chat_participants
+        GROUP BY chat_id
+        HAVING COUNT(*) = 2
+    ) pairs
+    ORDER BY direct_key, chat_id
+) pair
+WHERE c.id = pair.chat_id;
+
+CREATE UNIQUE INDEX idx_chats_direct_key ON chats(direct_key);
@@ -0,0 +1,10 @@
+-- Append-only log read by the per-instance session caches: a row with user_id evicts every
+-- cached token of that user (ban, unban, role change), a row with token evicts one session (logout)
+CREATE TABLE auth_invalidations (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER REFERENCES users(id),
+    token VARCHAR(255),
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX idx_auth_invalidations_created_at ON auth_invalidations(created_at);
@@ -0,0 +1,4 @@
+-- Sessions now hold refresh tokens; access tokens are signed and carry the session id,
+-- so logout revokes by session_id instead of by token
+ALTER TABLE auth_invalidations ADD COLUMN session_id INTEGER;
+ALTER TABLE auth_invalidations DROP COLUMN token;
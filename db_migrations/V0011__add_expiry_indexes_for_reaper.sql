@@ -0,0 +1,3 @@
+-- The maintenance reaper deletes expired rows in batches; without these it rescans both tables per batch
+CREATE INDEX idx_sessions_expires_at ON sessions(expires_at);
+CREATE INDEX idx_verification_codes_expires_at ON verification_codes(expires_at);
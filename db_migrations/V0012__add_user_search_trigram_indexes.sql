@@ -0,0 +1,17 @@
+-- Substring/prefix user search over lower-cased, accent-free names
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS unaccent;
+
+-- unaccent() is only STABLE because it looks the dictionary up at call time; pinning the
+-- dictionary makes the wrapper safe to mark IMMUTABLE so it can back expression indexes
+CREATE OR REPLACE FUNCTION user_search_key(value TEXT) RETURNS TEXT
+LANGUAGE sql IMMUTABLE STRICT PARALLEL SAFE
+AS $$ SELECT lower(unaccent('unaccent'::regdictionary, value)) $$;
+
+-- Trigram indexes serve "contains" matches of 3+ characters
+CREATE INDEX idx_users_username_trgm ON users USING GIN (user_search_key(username) gin_trgm_ops);
+CREATE INDEX idx_users_display_name_trgm ON users USING GIN (user_search_key(display_name) gin_trgm_ops);
+
+-- Two-character queries have no trigram to look up and fall back to prefix matches on these
+CREATE INDEX idx_users_username_search_prefix ON users (user_search_key(username) text_pattern_ops);
+CREATE INDEX idx_users_display_name_search_prefix ON users (user_search_key(display_name) text_pattern_ops);
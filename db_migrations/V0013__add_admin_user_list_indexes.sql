@@ -0,0 +1,7 @@
+-- Keyset pages of the admin user list: ORDER BY created_at DESC, id DESC
+CREATE INDEX idx_users_created_at_id ON users(created_at DESC, id DESC);
+
+-- Filters on small subsets get their own partial indexes; the "пользователь" role and
+-- non-banned users are most of the table and are served by the index above
+CREATE INDEX idx_users_banned_created_at_id ON users(created_at DESC, id DESC) WHERE is_banned;
+CREATE INDEX idx_users_staff_role_created_at_id ON users(role, created_at DESC, id DESC) WHERE role <> 'пользователь';
@@ -0,0 +1,24 @@
+-- Size-keyed thumbnails of the current avatar: {"48": {"webp": url, "jpeg": url}, "96": ..., "256": ...}
+-- NULL until the maintenance worker has rendered them; clients fall back to avatar_url meanwhile
+ALTER TABLE users ADD COLUMN avatars JSONB;
+
+-- Thumbnail jobs queued by the upload function in the same transaction as the new avatar_url
+CREATE TABLE avatar_jobs (
+    id BIGSERIAL PRIMARY KEY,
+    user_id INTEGER NOT NULL REFERENCES users(id),
+    source_key TEXT NOT NULL,
+    source_url TEXT NOT NULL,
+    attempts SMALLINT NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP
+);
+
+CREATE INDEX idx_avatar_jobs_pending ON avatar_jobs(id) WHERE processed_at IS NULL;
+CREATE INDEX idx_avatar_jobs_processed_at ON avatar_jobs(processed_at) WHERE processed_at IS NOT NULL;
+
+-- Existing uploaded avatars get thumbnails on the next maintenance run
+INSERT INTO avatar_jobs (user_id, source_key, source_url)
+SELECT id, substring(avatar_url FROM '/bucket/(avatars/.+)$'), avatar_url
+FROM users
+WHERE avatar_url ~ '/bucket/avatars/.+$';
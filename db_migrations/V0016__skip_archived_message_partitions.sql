@@ -0,0 +1,25 @@
+-- Never recreate a month that was already archived and detached: importing backdated history
+-- would otherwise bring the partition back and the next archive run would export it a second time.
+-- Rows for such months have no partition to land in and are rejected by the import.
+CREATE OR REPLACE FUNCTION ensure_messages_partitions(range_start TIMESTAMP, range_end TIMESTAMP)
+RETURNS INTEGER AS $$
+DECLARE
+    month_start DATE := date_trunc('month', range_start)::date;
+    partition_name TEXT;
+    created INTEGER := 0;
+BEGIN
+    WHILE month_start <= range_end LOOP
+        partition_name := 'messages_' || to_char(month_start, 'YYYY_MM');
+        IF to_regclass(partition_name) IS NULL
+        AND NOT EXISTS (SELECT 1 FROM message_archives a WHERE a.range_start = month_start) THEN
+            EXECUTE format(
+                'CREATE TABLE %I PARTITION OF messages FOR VALUES FROM (%L) TO (%L)',
+                partition_name, month_start, (month_start + INTERVAL '1 month')::date
+            );
+            created := created + 1;
+        END IF;
+        month_start := (month_start + INTERVAL '1 month')::date;
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
@@ -0,0 +1,26 @@
+-- Sync cursors are built from committed state: every change is stamped with the id of the
+-- transaction that wrote it, and a cursor only covers transactions older than the snapshot xmin.
+-- change_seq still orders rows inside a page, but its head is never handed out as a cursor.
+ALTER TABLE chats ADD COLUMN change_xid BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE chat_participants ADD COLUMN change_xid BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE messages ADD COLUMN change_xid BIGINT NOT NULL DEFAULT 0;
+ALTER TABLE contacts ADD COLUMN change_xid BIGINT NOT NULL DEFAULT 0;
+
+CREATE OR REPLACE FUNCTION stamp_change_xid() RETURNS TRIGGER AS $$
+BEGIN
+    NEW.change_xid := pg_current_xact_id()::text::bigint;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER chats_change_xid BEFORE INSERT OR UPDATE ON chats
+    FOR EACH ROW EXECUTE FUNCTION stamp_change_xid();
+CREATE TRIGGER chat_participants_change_xid BEFORE INSERT OR UPDATE ON chat_participants
+    FOR EACH ROW EXECUTE FUNCTION stamp_change_xid();
+CREATE TRIGGER messages_change_xid BEFORE INSERT OR UPDATE ON messages
+    FOR EACH ROW EXECUTE FUNCTION stamp_change_xid();
+CREATE TRIGGER contacts_change_xid BEFORE INSERT OR UPDATE ON contacts
+    FOR EACH ROW EXECUTE FUNCTION stamp_change_xid();
+
+CREATE INDEX idx_messages_chat_change_xid ON messages(chat_id, change_xid, change_seq);
+CREATE INDEX idx_contacts_user_change_xid ON contacts(user_id, change_xid);
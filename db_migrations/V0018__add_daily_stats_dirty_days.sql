@@ -0,0 +1,6 @@
+-- Days that imported history landed in, older than daily_active_users covers;
+-- the maintenance reconcile recounts them from messages and then clears the mark
+CREATE TABLE daily_stats_dirty (
+    day DATE PRIMARY KEY,
+    marked_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
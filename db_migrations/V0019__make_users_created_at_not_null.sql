@@ -0,0 +1,5 @@
+-- Keyset pagination of the admin user list compares (created_at, id): NULL rows never match the
+-- cursor and break its encoding, so every user gets a creation time
+UPDATE users SET created_at = COALESCE(updated_at, CURRENT_TIMESTAMP) WHERE created_at IS NULL;
+
+ALTER TABLE users ALTER COLUMN created_at SET NOT NULL;
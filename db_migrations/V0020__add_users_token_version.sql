@@ -0,0 +1,6 @@
+-- Per-user revocation counter: ban, unban and role change bump it under the users row lock and log
+-- the new value, access tokens carry the value they were issued with. Unlike auth_invalidations.id
+-- it is ordered by commit for each user, so a ban committed after a later-numbered row still applies
+ALTER TABLE users ADD COLUMN token_version INTEGER NOT NULL DEFAULT 0;
+
+ALTER TABLE auth_invalidations ADD COLUMN token_version INTEGER;
@@ -0,0 +1,3 @@
+-- Jobs are claimed with a lease and committed before rendering, so no transaction stays open while
+-- images are downloaded and encoded; a worker that dies mid-render releases the job when the lease expires
+ALTER TABLE avatar_jobs ADD COLUMN claimed_until TIMESTAMP;
@@ -50,7 +50,7 @@ export const AuthModal = ({ open, onClose, onSuccess }: AuthModalProps) => {
         throw new Error(data.error || 'Ошибка входа');
       }
 
-      setAuthToken(data.token);
+      setAuthToken(data.token, data.refresh_token);
       toast({ title: 'Успешно', description: 'Вы вошли в систему' });
       onSuccess();
       onClose();
@@ -123,7 +123,7 @@ export const AuthModal = ({ open, onClose, onSuccess }: AuthModalProps) => {
         throw new Error(data.error || 'Ошибка регистрации');
       }
 
-      setAuthToken(data.token);
+      setAuthToken(data.token, data.refresh_token);
       toast({ title: 'Успешно', description: 'Вы зарегистрированы!' });
       onSuccess();
       onClose();
@@ -9,12 +9,25 @@ export const getAuthToken = (): string | null => {
   return localStorage.getItem('auth_token');
 };
 
-export const setAuthToken = (token: string) => {
+export const setAuthToken = (token: string, refreshToken?: string) => {
   localStorage.setItem('auth_token', token);
+  if (refreshToken) {
+    localStorage.setItem('refresh_token', refreshToken);
+  }
 };
 
 export const clearAuthToken = () => {
   localStorage.removeItem('auth_token');
+  localStorage.removeItem('refresh_token');
+};
+
+// Tokens issued before signed access tokens are opaque session tokens: they work as refresh tokens
+export const getRefreshToken = (): string | null => {
+  const refreshToken = localStorage.getItem('refresh_token');
+  if (refreshToken) return refreshToken;
+  
+  const token = getAuthToken();
+  return token && !token.includes('.') ? token : null;
 };
 
 export const getAuthHeaders = () => {
@@ -24,3 +37,39 @@ export const getAuthHeaders = () => {
     ...(token ? { 'Authorization': `Bearer ${token}` } : {})
   };
 };
+
+let refreshing: Promise<boolean> | null = null;
+
+export const refreshAuthToken = (): Promise<boolean> => {
+  const refreshToken = getRefreshToken();
+  if (!refreshToken) return Promise.resolve(false);
+  
+  if (!refreshing) {
+    refreshing = fetch(`${API_URLS.AUTH}?action=refresh`, {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ refresh_token: refreshToken })
+    })
+      .then(async (response) => {
+        if (!response.ok) return false;
+        const data = await response.json();
+        setAuthToken(data.token, refreshToken);
+        return true;
+      })
+      .catch(() => false)
+      .finally(() => {
+        refreshing = null;
+      });
+  }
+  
+  return refreshing;
+};
+
+type AuthFetchInit = Omit<RequestInit, 'headers'> & { headers?: Record<string, string> };
+
+export const authFetch = async (url: string, init: AuthFetchInit = {}): Promise<Response> => {
+  const response = await fetch(url, { ...init, headers: { ...init.headers, ...getAuthHeaders() } });
+  if (response.status !== 401 || !(await refreshAuthToken())) return response;
+  
+  return fetch(url, { ...init, headers: { ...init.headers, ...getAuthHeaders() } });
+};
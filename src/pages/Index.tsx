@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import { Button } from '@/components/ui/button';
 import { Input } from '@/components/ui/input';
 import { Avatar, AvatarFallback, AvatarImage } from '@/components/ui/avatar';
@@ -10,9 +10,24 @@ import { Label } from '@/components/ui/label';
 import Icon from '@/components/ui/icon';
 import { Tabs, TabsContent, TabsList, TabsTrigger } from '@/components/ui/tabs';
 import { AuthModal } from '@/components/AuthModal';
-import { API_URLS, getAuthToken, clearAuthToken, getAuthHeaders } from '@/config/api';
+import { API_URLS, getAuthToken, clearAuthToken, getAuthHeaders, getRefreshToken, authFetch } from '@/config/api';
 import { useToast } from '@/hooks/use-toast';
 
+interface AdminStats {
+  days: { day: string; messages_sent: number; active_users: number; registrations: number; bans: number }[];
+  totals: { messages_sent: number; registrations: number; bans: number; unbans: number };
+  banned_now: number;
+}
+
+type AvatarSizes = Record<string, { webp: string; jpeg: string }>;
+
+interface AvatarOwner {
+  avatar_url?: string;
+  avatars?: AvatarSizes | null;
+}
+
+const avatarSrc = (owner: AvatarOwner, size: 48 | 96 | 256) => owner.avatars?.[size]?.webp ?? owner.avatar_url;
+
 type UserRole = 'владелец' | 'администратор' | 'VIP' | 'пользователь';
 
 interface User {
@@ -21,6 +36,7 @@ interface User {
   display_name: string;
   email?: string;
   avatar_url?: string;
+  avatars?: AvatarSizes | null;
   role: UserRole;
   is_banned: boolean;
   ban_reason?: string;
@@ -28,18 +44,22 @@ interface User {
 
 interface Chat {
   id: number;
+  updated_at?: string;
   other_user: {
     id: number;
     username: string;
     display_name: string;
     avatar_url?: string;
+    avatars?: AvatarSizes | null;
   };
   last_message?: string;
   last_message_time?: string;
+  unread_count?: number;
 }
 
 interface Message {
   id: number;
+  chat_id?: number;
   content: string;
   sender_id: number;
   created_at: string;
@@ -47,6 +67,7 @@ interface Message {
     username: string;
     display_name: string;
     avatar_url?: string;
+    avatars?: AvatarSizes | null;
   };
 }
 
@@ -59,11 +80,18 @@ const Index = () => {
   const [chats, setChats] = useState<Chat[]>([]);
   const [contacts, setContacts] = useState<User[]>([]);
   const [users, setUsers] = useState<User[]>([]);
+  const [usersCursor, setUsersCursor] = useState<string | null>(null);
+  const [usersTotal, setUsersTotal] = useState<number | null>(null);
+  const [usersQuery, setUsersQuery] = useState('');
+  const [stats, setStats] = useState<AdminStats | null>(null);
   const [selectedChat, setSelectedChat] = useState<Chat | null>(null);
   const [messages, setMessages] = useState<Message[]>([]);
+  const [messagesCursor, setMessagesCursor] = useState<number | null>(null);
   const [messageInput, setMessageInput] = useState('');
   const [searchQuery, setSearchQuery] = useState('');
   const [searchResults, setSearchResults] = useState<User[]>([]);
+  const syncCursor = useRef<string | null>(null);
+  const selectedChatId = useRef<number | null>(null);
   
   useEffect(() => {
     const token = getAuthToken();
@@ -76,7 +104,7 @@ const Index = () => {
 
   const loadCurrentUser = async () => {
     try {
-      const response = await fetch(`${API_URLS.USERS}?action=me`, {
+      const response = await authFetch(`${API_URLS.USERS}?action=me`, {
         headers: getAuthHeaders()
       });
       
@@ -84,8 +112,7 @@ const Index = () => {
       
       const data = await response.json();
       setCurrentUser(data);
-      loadChats();
-      loadContacts();
+      syncCursor.current = null;
     } catch {
       clearAuthToken();
       setShowAuth(true);
@@ -94,7 +121,7 @@ const Index = () => {
 
   const loadChats = async () => {
     try {
-      const response = await fetch(`${API_URLS.CHATS}?action=list`, {
+      const response = await authFetch(`${API_URLS.CHATS}?action=list`, {
         headers: getAuthHeaders()
       });
       const data = await response.json();
@@ -104,30 +131,72 @@ const Index = () => {
     }
   };
 
-  const loadContacts = async () => {
+  const mergeById = <T extends { id: number }>(prev: T[], changed: T[]) => {
+    const changedIds = new Set(changed.map(item => item.id));
+    return [...changed, ...prev.filter(item => !changedIds.has(item.id))];
+  };
+
+  const syncChanges = async (action: 'sync' | 'wait' = 'sync'): Promise<boolean> => {
     try {
-      const response = await fetch(`${API_URLS.CHATS}?action=contacts`, {
+      const since = syncCursor.current ? `&since=${encodeURIComponent(syncCursor.current)}` : '';
+      const response = await authFetch(`${API_URLS.CHATS}?action=${action}${since}`, {
         headers: getAuthHeaders()
       });
+      if (response.status === 400) syncCursor.current = null;
+      if (!response.ok) return false;
+      
       const data = await response.json();
-      setContacts(data.contacts || []);
+      if (data.chats?.length) {
+        setChats(prev => mergeById(prev, data.chats).sort((a, b) => (b.updated_at || '').localeCompare(a.updated_at || '')));
+      }
+      if (data.contacts?.length) {
+        setContacts(prev => mergeById(prev, data.contacts));
+      }
+      const chatMessages = (data.messages || []).filter((m: Message) => m.chat_id === selectedChatId.current);
+      if (chatMessages.length) {
+        setMessages(prev => {
+          const known = new Set(prev.map(m => m.id));
+          return [...prev, ...chatMessages.filter((m: Message) => !known.has(m.id))];
+        });
+      }
+      syncCursor.current = data.cursor;
+      
+      if (data.has_more) return syncChanges();
+      return true;
     } catch (error) {
-      console.error('Load contacts error:', error);
+      console.error('Sync error:', error);
+      return false;
     }
   };
 
   const loadMessages = async (chatId: number) => {
     try {
-      const response = await fetch(`${API_URLS.CHATS}?action=messages&chat_id=${chatId}`, {
+      const response = await authFetch(`${API_URLS.CHATS}?action=messages&chat_id=${chatId}`, {
         headers: getAuthHeaders()
       });
       const data = await response.json();
-      setMessages(data.messages || []);
+      setMessages((data.messages || []).reverse());
+      setMessagesCursor(data.next_cursor ?? null);
     } catch (error) {
       console.error('Load messages error:', error);
     }
   };
 
+  const loadOlderMessages = async (chatId: number) => {
+    if (!messagesCursor) return;
+    
+    try {
+      const response = await authFetch(`${API_URLS.CHATS}?action=messages&chat_id=${chatId}&before_id=${messagesCursor}`, {
+        headers: getAuthHeaders()
+      });
+      const data = await response.json();
+      setMessages(prev => [...(data.messages || []).reverse(), ...prev]);
+      setMessagesCursor(data.next_cursor ?? null);
+    } catch (error) {
+      console.error('Load older messages error:', error);
+    }
+  };
+
   const searchUsers = async (query: string) => {
     if (query.length < 2) {
       setSearchResults([]);
@@ -135,7 +204,7 @@ const Index = () => {
     }
     
     try {
-      const response = await fetch(`${API_URLS.USERS}?action=search&q=${encodeURIComponent(query)}`, {
+      const response = await authFetch(`${API_URLS.USERS}?action=search&q=${encodeURIComponent(query)}`, {
         headers: getAuthHeaders()
       });
       const data = await response.json();
@@ -147,7 +216,7 @@ const Index = () => {
 
   const createChat = async (userId: number) => {
     try {
-      const response = await fetch(`${API_URLS.CHATS}?action=create`, {
+      const response = await authFetch(`${API_URLS.CHATS}?action=create`, {
         method: 'POST',
         headers: getAuthHeaders(),
         body: JSON.stringify({ user_id: userId })
@@ -164,6 +233,7 @@ const Index = () => {
       const newChat = chats.find(c => c.id === data.chat_id);
       if (newChat) {
         setSelectedChat(newChat);
+        selectedChatId.current = newChat.id;
         loadMessages(data.chat_id);
       }
       setActiveSection('chats');
@@ -177,7 +247,7 @@ const Index = () => {
     if (!messageInput.trim() || !selectedChat) return;
     
     try {
-      const response = await fetch(`${API_URLS.CHATS}?action=send`, {
+      const response = await authFetch(`${API_URLS.CHATS}?action=send`, {
         method: 'POST',
         headers: getAuthHeaders(),
         body: JSON.stringify({
@@ -192,8 +262,7 @@ const Index = () => {
       }
       
       setMessageInput('');
-      loadMessages(selectedChat.id);
-      loadChats();
+      syncChanges();
     } catch (error: any) {
       toast({ title: 'Ошибка', description: error.message, variant: 'destructive' });
     }
@@ -201,7 +270,7 @@ const Index = () => {
 
   const addContact = async (userId: number) => {
     try {
-      const response = await fetch(`${API_URLS.CHATS}?action=add-contact`, {
+      const response = await authFetch(`${API_URLS.CHATS}?action=add-contact`, {
         method: 'POST',
         headers: getAuthHeaders(),
         body: JSON.stringify({ user_id: userId })
@@ -212,7 +281,7 @@ const Index = () => {
         throw new Error(data.error);
       }
       
-      loadContacts();
+      syncChanges();
       toast({ title: 'Успешно', description: 'Контакт добавлен' });
     } catch (error: any) {
       toast({ title: 'Ошибка', description: error.message, variant: 'destructive' });
@@ -221,26 +290,36 @@ const Index = () => {
 
   const uploadAvatar = async (file: File) => {
     try {
-      const reader = new FileReader();
-      reader.onloadend = async () => {
-        const base64 = reader.result as string;
-        
-        const response = await fetch(API_URLS.UPLOAD, {
-          method: 'POST',
-          headers: getAuthHeaders(),
-          body: JSON.stringify({ image: base64 })
-        });
-        
-        const data = await response.json();
-        
-        if (!response.ok) {
-          throw new Error(data.error);
-        }
-        
-        await updateProfile({ avatar_url: data.url });
-        toast({ title: 'Успешно', description: 'Аватар обновлён' });
-      };
-      reader.readAsDataURL(file);
+      const presignResponse = await authFetch(`${API_URLS.UPLOAD}?action=presign`, {
+        method: 'POST',
+        headers: getAuthHeaders(),
+        body: JSON.stringify({ content_type: file.type })
+      });
+      const presign = await presignResponse.json();
+      if (!presignResponse.ok) {
+        throw new Error(presign.error);
+      }
+      
+      const form = new FormData();
+      Object.entries(presign.fields as Record<string, string>).forEach(([name, value]) => form.append(name, value));
+      form.append('file', file);
+      const uploadResponse = await fetch(presign.url, { method: 'POST', body: form });
+      if (!uploadResponse.ok) {
+        throw new Error('Файл не загружен: допустимы изображения до 5 МБ');
+      }
+      
+      const confirmResponse = await authFetch(`${API_URLS.UPLOAD}?action=confirm`, {
+        method: 'POST',
+        headers: getAuthHeaders(),
+        body: JSON.stringify({ key: presign.key })
+      });
+      const data = await confirmResponse.json();
+      if (!confirmResponse.ok) {
+        throw new Error(data.error);
+      }
+      
+      loadCurrentUser();
+      toast({ title: 'Успешно', description: 'Аватар обновлён' });
     } catch (error: any) {
       toast({ title: 'Ошибка', description: error.message, variant: 'destructive' });
     }
@@ -253,7 +332,7 @@ const Index = () => {
         avatar_url: updates.avatar_url || currentUser?.avatar_url || ''
       };
       
-      const response = await fetch(`${API_URLS.USERS}?action=profile`, {
+      const response = await authFetch(`${API_URLS.USERS}?action=profile`, {
         method: 'PUT',
         headers: getAuthHeaders(),
         body: JSON.stringify(payload)
@@ -270,13 +349,19 @@ const Index = () => {
     }
   };
 
-  const loadAllUsers = async () => {
+  const loadAllUsers = async (append = false) => {
     try {
-      const response = await fetch(`${API_URLS.USERS}?action=list`, {
+      const params = new URLSearchParams({ action: 'list' });
+      if (usersQuery.trim()) params.set('q', usersQuery.trim());
+      if (append && usersCursor) params.set('cursor', usersCursor);
+      
+      const response = await authFetch(`${API_URLS.USERS}?${params}`, {
         headers: getAuthHeaders()
       });
       const data = await response.json();
-      setUsers(data.users || []);
+      setUsers(prev => append ? [...prev, ...(data.users || [])] : (data.users || []));
+      setUsersCursor(data.next_cursor || null);
+      if (!append) setUsersTotal(data.total_estimate ?? null);
     } catch (error) {
       console.error('Load users error:', error);
     }
@@ -284,7 +369,7 @@ const Index = () => {
 
   const banUser = async (userId: number, reason: string) => {
     try {
-      const response = await fetch(`${API_URLS.USERS}?action=ban`, {
+      const response = await authFetch(`${API_URLS.USERS}?action=ban`, {
         method: 'POST',
         headers: getAuthHeaders(),
         body: JSON.stringify({ user_id: userId, reason })
@@ -304,7 +389,7 @@ const Index = () => {
 
   const unbanUser = async (userId: number) => {
     try {
-      const response = await fetch(`${API_URLS.USERS}?action=unban`, {
+      const response = await authFetch(`${API_URLS.USERS}?action=unban`, {
         method: 'POST',
         headers: getAuthHeaders(),
         body: JSON.stringify({ user_id: userId })
@@ -324,7 +409,7 @@ const Index = () => {
 
   const setUserRole = async (userId: number, role: UserRole) => {
     try {
-      const response = await fetch(`${API_URLS.USERS}?action=set-role`, {
+      const response = await authFetch(`${API_URLS.USERS}?action=set-role`, {
         method: 'POST',
         headers: getAuthHeaders(),
         body: JSON.stringify({ user_id: userId, role })
@@ -351,15 +436,74 @@ const Index = () => {
     }
   };
 
+  const loadStats = async () => {
+    try {
+      const response = await authFetch(`${API_URLS.USERS}?action=stats`, {
+        headers: getAuthHeaders()
+      });
+      if (!response.ok) return;
+      setStats(await response.json());
+    } catch (error) {
+      console.error('Load stats error:', error);
+    }
+  };
+
+  const exportEntity = async (entity: 'users' | 'chats' | 'messages', format: 'ndjson' | 'csv') => {
+    try {
+      const response = await authFetch(`${API_URLS.USERS}?action=export&entity=${entity}&format=${format}`, {
+        headers: getAuthHeaders()
+      });
+      const data = await response.json();
+      if (!response.ok) {
+        toast({ title: 'Ошибка', description: data.error, variant: 'destructive' });
+        return;
+      }
+      window.open(data.url, '_blank');
+    } catch (error) {
+      console.error('Export error:', error);
+    }
+  };
+
   useEffect(() => {
     if (activeSection === 'admin') {
       loadAllUsers();
+      loadStats();
     }
   }, [activeSection]);
 
+  useEffect(() => {
+    if (!currentUser) return;
+    let active = true;
+    
+    const listen = async () => {
+      while (active) {
+        const ok = await syncChanges('wait');
+        if (!ok) await new Promise(resolve => setTimeout(resolve, 5000));
+      }
+    };
+    listen();
+    
+    return () => { active = false; };
+  }, [currentUser]);
+
+  const markChatRead = async (chatId: number) => {
+    try {
+      await authFetch(`${API_URLS.CHATS}?action=mark-read`, {
+        method: 'POST',
+        headers: getAuthHeaders(),
+        body: JSON.stringify({ chat_id: chatId })
+      });
+      setChats(prev => prev.map(c => c.id === chatId ? { ...c, unread_count: 0 } : c));
+    } catch (error) {
+      console.error('Mark read error:', error);
+    }
+  };
+
   const handleChatClick = (chat: Chat) => {
     setSelectedChat(chat);
+    selectedChatId.current = chat.id;
     loadMessages(chat.id);
+    if (chat.unread_count) markChatRead(chat.id);
   };
 
   const formatTime = (isoString?: string) => {
@@ -411,6 +555,11 @@ const Index = () => {
 
         <div className="mt-auto">
           <button onClick={() => {
+            fetch(`${API_URLS.AUTH}?action=logout`, {
+              method: 'POST',
+              headers: getAuthHeaders(),
+              body: JSON.stringify({ refresh_token: getRefreshToken() })
+            }).catch(() => {});
             clearAuthToken();
             setCurrentUser(null);
             setShowAuth(true);
@@ -452,7 +601,7 @@ const Index = () => {
                     }}>
                       <div className="flex items-center gap-3">
                         <Avatar>
-                          <AvatarImage src={user.avatar_url} />
+                          <AvatarImage src={avatarSrc(user, 96)} />
                           <AvatarFallback className="bg-yellow-400 text-gray-900">{user.display_name[0]}</AvatarFallback>
                         </Avatar>
                         <div>
@@ -469,7 +618,7 @@ const Index = () => {
                     <div key={chat.id} className={`px-6 py-4 hover:bg-yellow-50 cursor-pointer transition-colors border-b border-gray-100 ${selectedChat?.id === chat.id ? 'bg-yellow-50' : ''}`} onClick={() => handleChatClick(chat)}>
                       <div className="flex items-start gap-3">
                         <Avatar>
-                          <AvatarImage src={chat.other_user.avatar_url} />
+                          <AvatarImage src={avatarSrc(chat.other_user, 96)} />
                           <AvatarFallback className="bg-yellow-400 text-gray-900">{chat.other_user.display_name[0]}</AvatarFallback>
                         </Avatar>
                         <div className="flex-1 min-w-0">
@@ -477,7 +626,12 @@ const Index = () => {
                             <span className="font-semibold text-gray-900">{chat.other_user.display_name}</span>
                             <span className="text-xs text-gray-500">{formatTime(chat.last_message_time)}</span>
                           </div>
-                          <p className="text-sm text-gray-600 truncate">{chat.last_message || 'Нет сообщений'}</p>
+                          <div className="flex items-center justify-between gap-2">
+                            <p className="text-sm text-gray-600 truncate">{chat.last_message || 'Нет сообщений'}</p>
+                            {!!chat.unread_count && (
+                              <Badge className="bg-yellow-400 hover:bg-yellow-400 text-gray-900">{chat.unread_count}</Badge>
+                            )}
+                          </div>
                           <span className="text-xs text-gray-400">@{chat.other_user.username}</span>
                         </div>
                       </div>
@@ -498,7 +652,7 @@ const Index = () => {
                 <div className="bg-white border-b border-gray-200 px-6 py-4">
                   <div className="flex items-center gap-3">
                     <Avatar>
-                      <AvatarImage src={selectedChat.other_user.avatar_url} />
+                      <AvatarImage src={avatarSrc(selectedChat.other_user, 96)} />
                       <AvatarFallback className="bg-yellow-400 text-gray-900">{selectedChat.other_user.display_name[0]}</AvatarFallback>
                     </Avatar>
                     <div>
@@ -509,6 +663,13 @@ const Index = () => {
                 </div>
 
                 <div className="flex-1 overflow-y-auto p-6 space-y-4">
+                  {messagesCursor && (
+                    <div className="flex justify-center">
+                      <Button variant="ghost" size="sm" className="text-gray-500" onClick={() => loadOlderMessages(selectedChat.id)}>
+                        Загрузить предыдущие сообщения
+                      </Button>
+                    </div>
+                  )}
                   {messages.map((message) => (
                     <div key={message.id} className={`flex ${message.sender_id === currentUser.id ? 'justify-end' : 'justify-start'}`}>
                       <div className={`rounded-2xl px-4 py-3 max-w-xs shadow-sm ${message.sender_id === currentUser.id ? 'bg-yellow-400 rounded-tr-sm' : 'bg-white rounded-tl-sm'}`}>
@@ -572,7 +733,7 @@ const Index = () => {
                         <CardContent className="p-6">
                           <div className="flex items-center gap-4">
                             <Avatar className="h-14 w-14">
-                              <AvatarImage src={user.avatar_url} />
+                              <AvatarImage src={avatarSrc(user, 256)} />
                               <AvatarFallback className="bg-yellow-400 text-gray-900 text-lg">{user.display_name[0]}</AvatarFallback>
                             </Avatar>
                             <div className="flex-1">
@@ -596,7 +757,7 @@ const Index = () => {
                     <CardContent className="p-6">
                       <div className="flex items-center gap-4">
                         <Avatar className="h-14 w-14">
-                          <AvatarImage src={contact.avatar_url} />
+                          <AvatarImage src={avatarSrc(contact, 256)} />
                           <AvatarFallback className="bg-yellow-400 text-gray-900 text-lg">{contact.display_name[0]}</AvatarFallback>
                         </Avatar>
                         <div className="flex-1">
@@ -633,7 +794,7 @@ const Index = () => {
                   <div className="flex flex-col items-center mb-8">
                     <div className="relative mb-4">
                       <Avatar className="h-32 w-32">
-                        <AvatarImage src={currentUser.avatar_url} />
+                        <AvatarImage src={avatarSrc(currentUser, 256)} />
                         <AvatarFallback className="bg-yellow-400 text-gray-900 text-4xl">{currentUser.display_name[0]}</AvatarFallback>
                       </Avatar>
                       <label htmlFor="avatar-upload" className="absolute bottom-0 right-0 rounded-full bg-yellow-400 hover:bg-yellow-500 text-gray-900 p-3 cursor-pointer">
@@ -642,7 +803,7 @@ const Index = () => {
                       <input
                         id="avatar-upload"
                         type="file"
-                        accept="image/*"
+                        accept="image/jpeg,image/png,image/gif,image/webp"
                         className="hidden"
                         onChange={(e) => {
                           const file = e.target.files?.[0];
@@ -740,20 +901,31 @@ const Index = () => {
                 <TabsList className="mb-6">
                   <TabsTrigger value="users">Пользователи</TabsTrigger>
                   <TabsTrigger value="roles">Управление ролями</TabsTrigger>
+                  <TabsTrigger value="stats">Статистика</TabsTrigger>
                 </TabsList>
 
                 <TabsContent value="users">
                   <Card>
                     <CardHeader>
-                      <CardTitle>Список пользователей</CardTitle>
+                      <CardTitle>
+                        Список пользователей
+                        {usersTotal !== null && <span className="ml-2 text-sm font-normal text-gray-500">≈ {usersTotal}</span>}
+                      </CardTitle>
                     </CardHeader>
                     <CardContent>
+                      <Input
+                        placeholder="Поиск по имени или username"
+                        value={usersQuery}
+                        onChange={(e) => setUsersQuery(e.target.value)}
+                        onKeyDown={(e) => e.key === 'Enter' && loadAllUsers()}
+                        className="mb-4"
+                      />
                       <div className="space-y-4">
                         {users.map((user) => (
                           <div key={user.id} className="flex items-center justify-between p-4 border border-gray-200 rounded-lg hover:border-yellow-400 transition-colors">
                             <div className="flex items-center gap-4">
                               <Avatar>
-                                <AvatarImage src={user.avatar_url} />
+                                <AvatarImage src={avatarSrc(user, 96)} />
                                 <AvatarFallback className="bg-yellow-400 text-gray-900">{user.display_name[0]}</AvatarFallback>
                               </Avatar>
                               <div>
@@ -781,6 +953,44 @@ const Index = () => {
                           </div>
                         ))}
                       </div>
+                      {usersCursor && (
+                        <Button variant="outline" className="w-full mt-4" onClick={() => loadAllUsers(true)}>
+                          Показать ещё
+                        </Button>
+                      )}
+                    </CardContent>
+                  </Card>
+                </TabsContent>
+
+                <TabsContent value="stats">
+                  <Card>
+                    <CardHeader>
+                      <CardTitle>За последние 30 дней</CardTitle>
+                    </CardHeader>
+                    <CardContent>
+                      <div className="flex flex-wrap gap-2 mb-6">
+                        <Button variant="outline" size="sm" onClick={() => exportEntity('users', 'csv')}>Пользователи (CSV)</Button>
+                        <Button variant="outline" size="sm" onClick={() => exportEntity('chats', 'csv')}>Чаты (CSV)</Button>
+                        <Button variant="outline" size="sm" onClick={() => exportEntity('messages', 'ndjson')}>Сообщения (NDJSON)</Button>
+                      </div>
+                      {stats && (
+                        <>
+                          <div className="grid grid-cols-2 md:grid-cols-4 gap-4 mb-6">
+                            <div><p className="text-sm text-gray-500">Сообщений</p><p className="text-2xl font-bold">{stats.totals.messages_sent}</p></div>
+                            <div><p className="text-sm text-gray-500">Регистраций</p><p className="text-2xl font-bold">{stats.totals.registrations}</p></div>
+                            <div><p className="text-sm text-gray-500">Банов</p><p className="text-2xl font-bold">{stats.totals.bans}</p></div>
+                            <div><p className="text-sm text-gray-500">Заблокировано сейчас</p><p className="text-2xl font-bold">{stats.banned_now}</p></div>
+                          </div>
+                          <div className="space-y-1 text-sm">
+                            {[...stats.days].reverse().map((day) => (
+                              <div key={day.day} className="flex justify-between border-b border-gray-100 py-1">
+                                <span className="text-gray-500">{day.day}</span>
+                                <span>{day.messages_sent} сообщ. · {day.active_users} активных · {day.registrations} рег. · {day.bans} банов</span>
+                              </div>
+                            ))}
+                          </div>
+                        </>
+                      )}
                     </CardContent>
                   </Card>
                 </TabsContent>